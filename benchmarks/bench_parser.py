@@ -0,0 +1,170 @@
+"""
+Benchmarks for Parser, ExtraParser and RulesetParser on synthetic Cemu logs.
+Runs entirely offline: the GPU databases are synthetic and wiki pages are canned.
+
+Usage (from the repository root):
+    python benchmarks/bench_parser.py                     # run and compare against the baseline
+    python benchmarks/bench_parser.py --update-baseline   # run and store the results as the new baseline
+    python benchmarks/bench_parser.py --sizes 10K,1M --scenarios crash,no_game --no-memory
+Exits with status 1 if any stage regressed past the baseline's threshold.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "cemubot"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cogs.gpusearch import APIResult, GLVersion, GPUInfoSearch, VKVersion
+from cogs.parser import ExtraParser, Parser, RulesetParser, parse_log_file
+from cogs.wiki import CompatIndex
+from logs import SCENARIOS, generate_gpu_names, generate_log
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# a stage regresses if it's this many times slower (or bigger) than the baseline...
+DEFAULT_THRESHOLD = 1.5
+# ...and the difference is more than this many seconds, so that tiny timings don't flap
+MIN_TIME_DIFFERENCE = 0.002
+SIZES = {"K": 1024, "M": 1024 * 1024}
+
+WIKI_HTML = """<table>
+<tr style="vertical-align:middle;"><td><a href="/wiki/Release_1.11.0" title="Release 1.11.0">1.11.0</a></td>
+<td><a href="/wiki/Category:Runs_(Rating)" title="Category:Runs (Rating)">Runs</a></td></tr>
+<tr style="vertical-align:middle;"><td><a href="/wiki/Release_1.26.2" title="Release 1.26.2">1.26.2</a></td>
+<td><a href="/wiki/Category:Playable_(Rating)" title="Category:Playable (Rating)">Playable</a></td></tr>
+</table>""" * 20
+
+
+class OfflineWikiCache:
+    def get(self, title_id, url):
+        return WIKI_HTML
+
+
+def parse_size(size: str) -> int:
+    size = size.strip().upper()
+    if size[-1] in SIZES:
+        return int(float(size[:-1]) * SIZES[size[-1]])
+    return int(size)
+
+
+def offline_search_module(device_count: int=4000) -> GPUInfoSearch:
+    search_module = GPUInfoSearch(init_cache=False, memo_path=None, snapshot_path=None)
+    names = generate_gpu_names(device_count)
+    search_module.opengl_cache = {
+        name: APIResult(GLVersion(4, 6), f"https://opengl.gpuinfo.org/displayreport.php?id={i}")
+        for i, name in enumerate(names)
+    }
+    search_module.vulkan_cache = {
+        name: APIResult(VKVersion(1, 2, 170), f"https://vulkan.gpuinfo.org/listreports.php?devicename={i}")
+        for i, name in enumerate(names)
+    }
+    return search_module
+
+
+def build_stages():
+    with open(os.path.join(ROOT, "cemubot", "misc", "title_ids.json"), "r", encoding="utf-8") as f:
+        title_ids = json.load(f)
+    with open(os.path.join(ROOT, "cemubot", "misc", "rulesets.json"), "r", encoding="utf-8") as f:
+        rulesets = json.load(f)
+    parser = Parser()
+    extra_parser = ExtraParser(title_ids, offline_search_module(),
+                               wiki_cache=OfflineWikiCache(),
+                               compat_index=CompatIndex(os.path.join(tempfile.mkdtemp(), "compat_index.json")))
+    ruleset_parser = RulesetParser(rulesets)
+    fields = [func.name for func in extra_parser.embed]
+    # each stage takes (log, log_bytes, info), where info is ExtraParser's fully evaluated output;
+    # parse_log_file is the whole path that the bot runs on its parse executor
+    return {
+        "parser": lambda log, log_bytes, info: parser.parse(log).evaluate(),
+        "extra_parser": lambda log, log_bytes, info: extra_parser.parse(log).evaluate(),
+        "ruleset_parser": lambda log, log_bytes, info: ruleset_parser.parse(log, info),
+        "parse_log_file": lambda log, log_bytes, info: parse_log_file(log_bytes, extra_parser, ruleset_parser, fields),
+    }, extra_parser
+
+
+def measure(func, repeat: int, memory: bool) -> dict:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    result = {"time": min(times)}
+    if memory:
+        tracemalloc.start()
+        func()
+        result["peak"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def run(scenarios, sizes, repeat: int, memory: bool) -> dict:
+    stages, extra_parser = build_stages()
+    results = {}
+    for scenario in scenarios:
+        for size_name in sizes:
+            log = generate_log(scenario, parse_size(size_name))
+            log_bytes = log.encode("utf-8")
+            info = extra_parser.parse(log).evaluate()
+            for stage, func in stages.items():
+                key = f"{scenario}/{size_name}/{stage}"
+                results[key] = measure(lambda: func(log, log_bytes, info), repeat, memory)
+                peak = f"{results[key]['peak'] / 1024 / 1024:8.2f} MB" if memory else ""
+                print(f"{key:<45} {results[key]['time'] * 1000:10.2f} ms {peak}")
+    return results
+
+
+def compare(results: dict, baseline: dict) -> list:
+    threshold = baseline.get("threshold", DEFAULT_THRESHOLD)
+    regressions = []
+    for key, result in results.items():
+        old = baseline["results"].get(key)
+        if old is None:
+            continue
+        if result["time"] > old["time"] * threshold and result["time"] - old["time"] > MIN_TIME_DIFFERENCE:
+            regressions.append(f"{key}: {old['time'] * 1000:.2f} ms -> {result['time'] * 1000:.2f} ms")
+        if "peak" in result and "peak" in old and result["peak"] > old["peak"] * threshold:
+            regressions.append(f"{key}: peak {old['peak']} B -> {result['peak']} B")
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                            help="comma-separated list of scenarios (default: all)")
+    arg_parser.add_argument("--sizes", default="10K,1M,10M,50M",
+                            help="comma-separated list of log sizes (default: 10K,1M,10M,50M)")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="timing runs per stage; the best one is kept")
+    arg_parser.add_argument("--no-memory", action="store_true", help="skip the peak memory measurements")
+    arg_parser.add_argument("--update-baseline", action="store_true", help="store the results as the new baseline")
+    args = arg_parser.parse_args()
+
+    results = run(args.scenarios.split(","), args.sizes.split(","), args.repeat, not args.no_memory)
+    if args.update_baseline:
+        baseline = {"threshold": DEFAULT_THRESHOLD, "results": {}}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline["results"].update(results)
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        print(f"Baseline written to {BASELINE_PATH}")
+        return
+    if not os.path.exists(BASELINE_PATH):
+        print("No baseline to compare against; run with --update-baseline to create one.")
+        return
+    with open(BASELINE_PATH, "r", encoding="utf-8") as f:
+        regressions = compare(results, json.load(f))
+    if regressions:
+        print("Regressions:")
+        print("\n".join(regressions))
+        sys.exit(1)
+    print("No regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Generator for synthetic Cemu logs, used by the parser benchmarks.
+Every scenario produces a log that looks like the ones posted in the parsing channel,
+padded out with realistic runtime messages until it reaches the requested size.
+"""
+import random
+
+# scenario -> (cemu_version, backend, cemuhook, accurate_barriers, crashed, loaded_title)
+SCENARIOS = {
+    "cemuhook_opengl": ("1.15.19b", "OpenGL", True, None, False, True),
+    "vulkan_1.26": ("1.26.2f", "Vulkan", True, "Accurate barriers: Enabled", False, True),
+    "vulkan_1.27": ("1.27.1", "Vulkan", False, "Accurate barriers are disabled!", False, True),
+    "opengl_1.27": ("1.27.1", "OpenGL", False, None, False, True),
+    "crash": ("1.26.2f", "Vulkan", True, "Accurate barriers: Enabled", True, True),
+    "no_game": ("1.27.1", "Vulkan", False, None, False, False),
+}
+
+GPUS = {
+    "OpenGL": [
+        ("GeForce GTX 970/PCIe/SSE2", "4.6.0 NVIDIA 456.71"),
+        ("AMD Radeon RX 580 Series", "4.6.14761 Compatibility Profile Context 21.3.2 27.20.15003.1004"),
+        ("Intel(R) UHD Graphics 620", "4.6.0 - Build 27.20.100.8681"),
+    ],
+    "Vulkan": [
+        ("NVIDIA GeForce RTX 3060", "471.96.0.0"),
+        ("AMD Radeon RX 6700 XT", "2.0.194"),
+        ("Intel(R) UHD Graphics 620", "0.404.1951"),
+    ],
+}
+
+FILLER = [
+    "Shader cache: compiled pipeline {:016x}",
+    "Loading graphic pack shader override {:016x}_0000000000000079_ps",
+    "GX2SetSurfaceFormat: unsupported format 0x{:x}",
+    "nn_act.GetPersistentIdEx(1) -> 0x{:x}",
+    "FSOpenFile: /vol/content/Actor/Pack/{:08x}.sbactorpack",
+    "Vulkan-Info: creating texture view 0x{:x} (format 19)",
+    "OSScreenSetBufferEx: framebuffer at 0x{:08x}",
+]
+
+
+def timestamp(ms: int) -> str:
+    return f"[{ms // 3600000:02}:{ms // 60000 % 60:02}:{ms // 1000 % 60:02}.{ms % 1000:03}]"
+
+
+def generate_log(scenario: str, size: int, seed: int=0) -> str:
+    """Returns a synthetic Cemu log for the given scenario, roughly size bytes long."""
+    rng = random.Random(seed)
+    version, backend, cemuhook, barriers, crashed, loaded = SCENARIOS[scenario]
+    gpu, driver = rng.choice(GPUS[backend])
+    header = [
+        f"------- Init Cemu {version} -------",
+        "Init Wii U memory space (base: 0x000001d140000000)",
+        "mlc01 path: C:/Cemu/mlc01",
+        "CPU: AMD Ryzen 7 3700X 8-Core Processor             ",
+        f"RAM: {rng.choice([7900, 16334, 32718])}MB",
+        "Platform: Windows 10",
+        "Used CPU extensions: SSSE3, SSE4.1, AVX, AVX2, LZCNT, MOVBE, BMI1, BMI2, ADX",
+    ]
+    if cemuhook:
+        header.append("Cemuhook version: 0.5.7.6")
+    header += [
+        "Set process CPU affinity to CPU0 CPU1 CPU2 CPU3 CPU4 CPU5",
+        f"------- Init {backend} graphics backend -------",
+    ]
+    if backend == "OpenGL":
+        header += ["GL_VENDOR: Vendor", f"GL_RENDERER: {gpu}", f"GL_VERSION: {driver}"]
+    else:
+        header += [
+            "Vulkan instance version: 1.2.170",
+            f"Using GPU: {gpu}",
+            f"Driver version (as stored in device info): {driver}",
+            "Async compile: true",
+        ]
+        if barriers:
+            header.append(barriers)
+    if loaded:
+        header += [
+            "------- Loaded title -------",
+            "TitleId: 00050000-101c9400",
+            "TitleVersion: v208",
+            "TitleColdBootApp: U-King.rpx",
+            "RPX hash (base): 0x3e33f5c9",
+            "RPX hash (updated): 0x9abcdef0",
+            "Shader cache file: shaderCache/transferable/00050000101c9400.bin",
+            "Recompiler initialized. CPU extensions: SSSE3 SSE4.1 AVX AVX2 LZCNT MOVBE BMI1 BMI2 ",
+            "CPU extensions that will actually be used by recompiler: SSSE3 SSE4.1 AVX LZCNT ",
+            "CPU-Mode: Multi-core recompiler",
+            "Console region: Auto",
+            "Thread quantum set to 45000",
+            "Custom timer mode: none",
+            "Full sync at GX2DrawDone: true",
+        ]
+    footer = []
+    if crashed:
+        footer = [
+            "Unhandled exception 0xc0000005",
+            "Stack trace",
+            "0x00007ff6ab3d9be4 Cemu.exe+0x001d9be4",
+            "0x00007ffd12340000 ow-graphics-vulkan.dll+0x00012345",
+            "0x00007ffd45670000 ntdll.dll+0x0006fa11",
+        ]
+    lines = []
+    ms = 10
+    length = 0
+    footer_length = sum(len(line) + 16 for line in footer)
+    for line in header:
+        lines.append(f"{timestamp(ms)} {line}")
+        length += len(lines[-1]) + 1
+    while length + footer_length < size:
+        ms += rng.randint(0, 40)
+        lines.append(f"{timestamp(ms)} " + rng.choice(FILLER).format(rng.getrandbits(48)))
+        length += len(lines[-1]) + 1
+    for line in footer:
+        lines.append(f"{timestamp(ms)} {line}")
+    return "\n".join(lines) + "\n"
+
+
+def generate_gpu_names(count: int, seed: int=0) -> list:
+    """Synthetic device names shaped like the ones in the gpuinfo.org databases."""
+    rng = random.Random(seed)
+    names = [gpu for gpus in GPUS.values() for gpu, driver in gpus]
+    vendors = [
+        ("NVIDIA GeForce ", ["GTX {}0", "GTX {}60", "RTX {}070", "RTX {}080 Ti", "MX{}50"]),
+        ("AMD Radeon ", ["RX {}80", "RX {}700 XT", "R9 {}90X", "HD {}870", "Pro W{}100"]),
+        ("Intel(R) ", ["HD Graphics {}20", "UHD Graphics {}30", "Iris(R) Xe Graphics G{}"]),
+        ("Mali-", ["G{}6", "T{}80"]),
+        ("Adreno (TM) ", ["{}30", "{}40"]),
+    ]
+    while len(names) < count:
+        prefix, models = rng.choice(vendors)
+        names.append(prefix + rng.choice(models).format(rng.randint(1, 9)) + rng.choice(["", "/PCIe/SSE2", " (Mobile)", " Max-Q"]))
+    return names[:count]
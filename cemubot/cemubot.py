@@ -1,34 +1,162 @@
+import aiohttp
 import asyncio
+import concurrent.futures
 import datetime
 import discord
 from discord.ext import commands
+import functools
+import hashlib
 import json
-import requests
 import time
 import traceback
+from typing import Optional
 
+from cogs.cache import LRUCache
 from cogs.gpusearch import GPUInfoSearch
+from cogs import metrics
 # parser isn't a cog but it's in the cogs folder if you want to add commands to it
+from cogs import parser as log_parser
 from cogs.parser import ExtraParser, RulesetParser
+from cogs.scheduler import ParseScheduler
+from cogs.timings import ParseTimings
+from cogs.titles import TitleStore
+from cogs.wiki import CompatIndex, WikiPageCache
 
 # if you want to add any cogs, put them here
 # example: ["cogs.foo", "cogs.bar", ...]
-startup_extensions = ["cogs.utility", "cogs.compat", "cogs.site", "cogs.quotes", "cogs.rules"]
+startup_extensions = ["cogs.utility", "cogs.compat", "cogs.site", "cogs.quotes", "cogs.rules", "cogs.wiki", "cogs.metrics", "cogs.gpusearch"]
 
 
 class Cemubot(commands.Bot):
 	quotes_ready: bool = False
 	rules_ready: bool = False
+	http_session: Optional[aiohttp.ClientSession] = None
+	# how much of a log is read before deciding whether it's actually a Cemu log
+	log_probe_size: int = 4096
+	log_fetch_timeout = aiohttp.ClientTimeout(total=60, sock_connect=10, sock_read=15)
+	# every field that parse_log and create_embed read; since fields are evaluated lazily,
+	# anything that's not in here or read by a rule never gets computed
+	embed_fields = [
+		"game.title_id", "game.title_version", "game.rpx_hash.updated", "game.rpx_hash.base",
+		"game.wiki_page.url", "game.compat.rating", "game.compat.version",
+		"emulator.cemu_version", "emulator.cemuhook_version",
+		"specs.cpu", "specs.ram", "specs.gpu", "specs.gpu_driver", "specs.gfx_api_version",
+		"specs.opengl.version", "specs.opengl.url", "specs.vulkan.version", "specs.vulkan.url",
+		"settings.cpu_mode", "settings.cpu_affinity", "settings.backend", "settings.vulkan_async",
+		"settings.accurate_barriers", "settings.gx2drawdone", "settings.custom_timer_mode"
+	]
 
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
-		with open("misc/title_ids.json", "r", encoding="utf-8") as f:
-			self.title_ids = json.load(f)
+		# loaded lazily, the first time a title is looked up
+		self.title_ids = TitleStore()
 		with open("misc/rulesets.json", "r", encoding="utf-8") as f:
 			self.rulesets = json.load(f)
-		self.search_module = GPUInfoSearch()
-		self.parser = ExtraParser(self.title_ids, self.search_module)
+		# loads the last snapshot of the GPU databases; the GPUSearch cog keeps them up to date
+		self.search_module = GPUInfoSearch(init_cache=False)
+		self.wiki_cache = WikiPageCache(ttl=config.cfg.get("wiki_cache_ttl", 6*60*60))
+		self.compat_index = CompatIndex()
+		self.parser = ExtraParser(self.title_ids, self.search_module,
+			wiki_cache=self.wiki_cache, compat_index=self.compat_index)
 		self.ruleset_parser = RulesetParser(self.rulesets)
+		# per-field and per-rule parse timings, shown by the parse_timings command
+		self.parse_timings = ParseTimings() if config.cfg.get("parse_timings", False) else None
+		self.parser.timings = self.ruleset_parser.timings = self.parse_timings
+		self.parse_executor = self.create_parse_executor()
+		# (info, relevant_info) of recently parsed logs, keyed by log_digest()
+		self.parse_cache = LRUCache(config.cfg.get("parse_cache_size", 128))
+		self.parse_scheduler = ParseScheduler(self.handle_log,
+			workers=config.cfg.get("parse_workers", 4),
+			max_size=config.cfg.get("parse_queue_size", 50),
+			max_per_user=config.cfg.get("parse_queue_per_user", 3))
+	def create_parse_executor(self):
+		"""
+		Creates the executor that logs are parsed on, so that parsing (and the requests it makes)
+		doesn't block the event loop. "parse_executor" in the config can be
+		"thread" (default), "process", or "none" to parse on the event loop.
+		"""
+		mode = config.cfg.get("parse_executor", "thread")
+		workers = config.cfg.get("parse_workers", 4)
+		if mode == "thread":
+			return concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="parser")
+		elif mode == "process":
+			executor = concurrent.futures.ProcessPoolExecutor(
+				max_workers=workers,
+				initializer=log_parser.init_worker,
+				initargs=(self.title_ids, self.rulesets, self.search_module.snapshot_path,
+						  self.wiki_cache.ttl, self.parse_timings is not None))
+			# start every worker now instead of on the first log
+			for _ in range(workers):
+				executor.submit(log_parser.worker_ready)
+			return executor
+		return None
+	@staticmethod
+	def log_digest(log: bytes) -> bytes:
+		"""Digest of a log file that ignores line ending differences; used as the parse cache key."""
+		return hashlib.blake2b(log.replace(b"\r", b""), digest_size=16).digest()
+	def invalidate_parse_cache(self):
+		"""Call this whenever the title IDs, rulesets, GPU databases or compatibility data change."""
+		self.parse_cache.clear()
+	def reload_parse_workers(self):
+		"""Restarts the parse worker processes (if any) so that they pick up new reference data."""
+		if isinstance(self.parse_executor, concurrent.futures.ProcessPoolExecutor):
+			old_executor = self.parse_executor
+			self.parse_executor = self.create_parse_executor()
+			# logs that the old workers are already parsing still finish
+			old_executor.shutdown(wait=False)
+	def on_gpu_databases_swapped(self):
+		self.invalidate_parse_cache()
+		self.reload_parse_workers()
+	def on_title_ids_swapped(self):
+		"""Call this after self.title_ids.update(); the Compat cog rebuilds its search on the event."""
+		self.invalidate_parse_cache()
+		self.reload_parse_workers()
+		self.dispatch("title_ids_swapped")
+	async def setup_hook(self):
+		# databases can be swapped in from a background thread, so hop back onto the event loop
+		self.search_module.on_swap = functools.partial(
+			asyncio.get_running_loop().call_soon_threadsafe, self.on_gpu_databases_swapped)
+		self.parse_scheduler.start()
+	async def close(self):
+		self.parse_scheduler.stop()
+		self.search_module.save_memo()
+		if self.parse_executor:
+			self.parse_executor.shutdown(wait=False, cancel_futures=True)
+		if self.http_session:
+			await self.http_session.close()
+		await super().close()
+	def get_http_session(self) -> aiohttp.ClientSession:
+		"""Returns the bot's pooled HTTP session, creating it if needed."""
+		if self.http_session is None or self.http_session.closed:
+			self.http_session = aiohttp.ClientSession(timeout=self.log_fetch_timeout,
+				trace_configs=[metrics.trace_config()])
+		return self.http_session
+	async def fetch_log(self, url: str) -> Optional[bytes]:
+		"""
+		Streams a log file from url without blocking the event loop.
+		Returns None if the request fails, the file is larger than "log_max_size" (in bytes),
+		or the start of the file doesn't look like a Cemu log.
+		"""
+		max_size = config.cfg.get("log_max_size", 16 * 1024 * 1024)
+		try:
+			async with self.get_http_session().get(url) as res:
+				if res.status != 200 or (res.content_length or 0) > max_size:
+					return None
+				log_data = bytearray()
+				probed = False
+				async for chunk in res.content.iter_chunked(64 * 1024):
+					log_data += chunk
+					if len(log_data) > max_size:
+						return None
+					if not probed and len(log_data) >= self.log_probe_size:
+						if b"Init Cemu" not in log_data:
+							return None
+						probed = True
+				if not probed and b"Init Cemu" not in log_data:
+					return None
+				return bytes(log_data)
+		except (aiohttp.ClientError, asyncio.TimeoutError):
+			return None
 	async def on_ready(self):
 		import _version as v
 		print(
@@ -54,6 +182,30 @@ f"""
 	async def sync_commands_when_finished(self):
 		if self.quotes_ready and self.rules_ready:
 			await self.tree.sync()
+	@staticmethod
+	def is_parsing_channel(channel) -> bool:
+		return channel.id == config.cfg["parsing_channel"]["preferred"] \
+			or channel.id in config.cfg["parsing_channel"]["alternates"] \
+			or not config.cfg["parsing_channel"]["preferred"]
+	@staticmethod
+	def is_log_attachment(attachment: discord.Attachment) -> bool:
+		"""Checks whether an attachment could be a log file, using only its metadata."""
+		if not attachment.filename.endswith(".txt"):
+			return False
+		if attachment.content_type and not attachment.content_type.startswith("text/"):
+			return False
+		return attachment.size <= config.cfg.get("log_max_size", 16 * 1024 * 1024)
+	async def probe_log(self, url: str) -> bool:
+		"""Checks whether the file at url is a Cemu log by only downloading the start of it."""
+		headers = {"Range": f"bytes=0-{self.log_probe_size - 1}"}
+		try:
+			async with self.get_http_session().get(url, headers=headers) as res:
+				if res.status not in (200, 206):
+					return False
+				# if the server ignores the range, stop reading after the probe anyway
+				return b"Init Cemu" in await res.content.read(self.log_probe_size)
+		except (aiohttp.ClientError, asyncio.TimeoutError):
+			return False
 	async def on_message(self, message):
 		if message.author.id == self.user.id:
 			return
@@ -61,46 +213,70 @@ f"""
 			if not embed.url or not embed.title:
 				continue
 			if '://pastebin.com/' in embed.url and ('Init Cemu' in embed.title or 'Outdated graphic pack' in embed.title):
-				if message.channel.id == config.cfg["parsing_channel"]["preferred"] \
-				or message.channel.id in config.cfg["parsing_channel"]["alternates"] \
-				or not config.cfg["parsing_channel"]["preferred"]:
+				if self.is_parsing_channel(message.channel):
 					embed.url = embed.url.replace(".com/", ".com/raw/")
-					log_data = requests.get(embed.url).content
+					log_data = await self.fetch_log(embed.url)
+					if log_data is None:
+						continue
+					metrics.logs_detected.inc()
 					reply_msg = await message.channel.send("Log detected, parsing...")
-					try:
-						await self.parse_log(embed.url, log_data, reply_msg)
-					except Exception as e:
-						await reply_msg.edit(content=f"Error: Couldn't parse log; parser threw {type(e).__name__} exception")
-						traceback.print_exc()
+					await self.parse_scheduler.submit(self.log_digest(log_data), embed.url, log_data, message, reply_msg)
 		for attachment in message.attachments:
-			log_data = await attachment.read()
-			if attachment.filename.endswith(".txt") and b"Init Cemu" in log_data:
-				if message.channel.id == config.cfg["parsing_channel"]["preferred"] \
-				or message.channel.id in config.cfg["parsing_channel"]["alternates"] \
-				or not config.cfg["parsing_channel"]["preferred"]:
-					reply_msg = await message.channel.send("Log detected, parsing...")
-					try:
-						await self.parse_log(attachment.url, log_data, reply_msg)
-					except Exception as e:
-						await reply_msg.edit(content=f"Error: Couldn't parse log; parser threw {type(e).__name__} exception")
-						traceback.print_exc()
-				else:
-					await message.channel.send(f"Log detected, please post logs in <#{config.cfg['parsing_channel']['preferred']}>.")
+			# decide as much as possible from the attachment's metadata,
+			# so that images and other files are never downloaded
+			if not self.is_log_attachment(attachment):
+				continue
+			if self.is_parsing_channel(message.channel):
+				log_data = await self.fetch_log(attachment.url)
+				if log_data is None:
+					continue
+				metrics.logs_detected.inc()
+				reply_msg = await message.channel.send("Log detected, parsing...")
+				await self.parse_scheduler.submit(self.log_digest(log_data), attachment.url, log_data, message, reply_msg)
+			elif await self.probe_log(attachment.url):
+				await message.channel.send(f"Log detected, please post logs in <#{config.cfg['parsing_channel']['preferred']}>.")
 		await self.process_commands(message)
 	
+	async def handle_log(self, log_url: str, log_data: bytes, reply_msg: discord.Message):
+		"""Called by the parse scheduler for every log it takes off the queue."""
+		try:
+			await self.parse_log(log_url, log_data, reply_msg)
+		except Exception as e:
+			metrics.logs_failed.inc()
+			await reply_msg.edit(content=f"Error: Couldn't parse log; parser threw {type(e).__name__} exception")
+			traceback.print_exc()
+	async def run_parse(self, log, parser=None, ruleset_parser=None) -> tuple:
+		"""Parses a log on the parse executor; see parser.parse_log_file()."""
+		if isinstance(self.parse_executor, concurrent.futures.ProcessPoolExecutor) \
+		and parser is None and ruleset_parser is None:
+			# worker processes have their own copies of the parsers, and send back their timings
+			job = functools.partial(log_parser.worker_parse_log_file, log, self.embed_fields)
+			info, relevant_info, samples = await asyncio.get_running_loop().run_in_executor(self.parse_executor, job)
+			if self.parse_timings is not None:
+				self.parse_timings.record_many(samples)
+			return info, relevant_info
+		job = functools.partial(log_parser.parse_log_file, log,
+			parser or self.parser, ruleset_parser or self.ruleset_parser, self.embed_fields)
+		if self.parse_executor:
+			return await asyncio.get_running_loop().run_in_executor(self.parse_executor, job)
+		return job()
 	async def parse_log(self, log_url, log, message, parser=None, ruleset_parser=None):
 		start_time = time.time()
-		if parser is None:
-			parser = self.parser
-		if ruleset_parser is None:
-			ruleset_parser = self.ruleset_parser
-		try:
-			log = log.decode('utf-8').replace('\r', '')
-		except UnicodeDecodeError:
-			# brazilian portugese was causing problems
-			log = log.decode('latin-1').replace('\r', '')
-		info = parser.parse(log)
-		if not info["init.loaded_title"]:
+		# custom parsers bypass the cache, since their results could be different
+		use_cache = parser is None and ruleset_parser is None
+		cached = None
+		if use_cache:
+			cache_key = self.log_digest(log)
+			cached = self.parse_cache.get(cache_key)
+		if cached is not None:
+			info, relevant_info = cached
+		else:
+			info, relevant_info = await self.run_parse(log, parser, ruleset_parser)
+			if use_cache:
+				self.parse_cache.put(cache_key, (info, relevant_info))
+		metrics.parse_seconds.observe(time.time() - start_time, cached=str(cached is not None).lower())
+		if relevant_info is None:
+			metrics.logs_parsed.inc(result="crashed" if info["init.game_crashed"] else "no_game")
 			if info["init.game_crashed"]:
 				if info["init.piracy_check"]:
 					await message.edit(content="Error: Cemu crashed before loading the game. This was caused by bad game files.")
@@ -111,13 +287,19 @@ f"""
 			else:
 				await message.edit(content="Error: No game detected. Submit a log during or after emulating a game. Reopening Cemu clears the log.")
 			return
-		relevant_info = ruleset_parser.parse(log, info)
-		relevant_info += [
+		# relevant_info may be shared with the cache, so don't modify it in place
+		metrics.logs_parsed.inc(result="ok")
+		relevant_info = relevant_info + [
 			f"ℹ️ RPX hash (updated): `{info['game.rpx_hash.updated']}` ║ RPX hash (base): `{info['game.rpx_hash.base']}`"
 		]
+		footer = f"Parsed in {round(time.time() - start_time, 3)}s"
+		if cached is not None:
+			footer += " (cached)"
+		if self.parse_cache.hit_ratio is not None:
+			footer += f" ║ Cache hit rate: {round(self.parse_cache.hit_ratio * 100)}%"
 		# TODO: reimplement "Some information was not found"
 		await message.edit(content=None,
-			embed=self.create_embed(log_url, info, relevant_info).set_footer(text=f"Parsed in {round(time.time() - start_time, 3)}s"))
+			embed=self.create_embed(log_url, info, relevant_info).set_footer(text=footer))
 	
 	def create_embed(self, log_url: str, info: dict, relevant_info: list=["N/A"]) -> discord.Embed:
 		try:
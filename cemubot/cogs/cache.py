@@ -0,0 +1,95 @@
+# caching helpers shared by the parsers and cogs
+from collections import OrderedDict
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Hashable, Optional
+
+
+class LRUCache:
+    """
+    A thread-safe dict with a maximum size; once it's full,
+    the least recently used entry is evicted to make room for new ones.
+    Keeps track of its hits and misses so that its effectiveness can be reported.
+    """
+    def __init__(self, max_size: int=256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any=None) -> Any:
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return self._data[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any=None) -> Any:
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def items(self) -> list:
+        """(key, value) pairs from least to most recently used."""
+        with self._lock:
+            return list(self._data.items())
+
+    @property
+    def hit_ratio(self) -> Optional[float]:
+        total = self.hits + self.misses
+        return self.hits / total if total else None
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# the umask can only be read by setting it, so read it once, before any other threads start
+umask = os.umask(0)
+os.umask(umask)
+
+def replace_file(temp_path: str, path: str) -> None:
+    """
+    os.replace(temp_path, path), for temporary files from tempfile.mkstemp(); the new file gets the mode of
+    the file that it replaces (or that open() would create it with), instead of mkstemp()'s owner-only 0600.
+    """
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = 0o666 & ~umask
+    os.chmod(temp_path, mode)
+    os.replace(temp_path, path)
+
+def atomic_write_json(path: str, obj: Any, **kwargs) -> None:
+    """
+    Writes obj to path as JSON, so that readers (including other processes)
+    only ever see either the old file or the complete new one.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(obj, f, **kwargs)
+        replace_file(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
@@ -1,36 +1,130 @@
 from discord import app_commands
 from discord.ext import commands
-from thefuzz import process
+from rapidfuzz import fuzz, process
+from thefuzz import utils
 import discord
 import urllib.parse
 import re
+from typing import Dict, List, Optional
+
+from cogs.cache import LRUCache
+
+
+class TitleSearchIndex:
+    """
+    Fuzzy search over Compat's search_dict, built once per version of the title IDs.
+    best() returns what thefuzz's process.extractOne(query, names, score_cutoff=60) would,
+    but the names are only normalized once, here, instead of on every search.
+    complete() is for autocomplete: it looks up the names with a word that starts with each
+    of the query's words in buckets keyed by the words' first few letters, and only falls back
+    to scoring every name if none do. Both cache their last few hundred results.
+    """
+    # how many letters of each word the prefix buckets are keyed by
+    prefix_length = 3
+    # Discord shows at most 25 autocomplete choices
+    max_choices = 25
+
+    def __init__(self, search_dict: Dict[str, str]):
+        self.names = list(search_dict)
+        # the same preprocessing that thefuzz does for WRatio
+        self.processed = [utils.full_process(name, force_ascii=True) for name in self.names]
+        # word prefix (up to prefix_length letters) -> indices of the names with a word that starts with it
+        self.prefixes: Dict[str, List[int]] = {}
+        for i, name in enumerate(self.processed):
+            for prefix in {word[:length] for word in name.split() for length in range(1, self.prefix_length + 1)}:
+                self.prefixes.setdefault(prefix, []).append(i)
+        self.results = LRUCache(512)
+
+    @staticmethod
+    def process_query(query: str) -> str:
+        return utils.full_process(utils.full_process(query), force_ascii=True)
+
+    def best(self, query: str, score_cutoff: int=60) -> Optional[str]:
+        """The name that's most similar to query, or None if none score at least score_cutoff."""
+        key = ("best", query, score_cutoff)
+        if key in self.results:
+            return self.results.get(key)
+        match = process.extractOne(self.process_query(query), self.processed, scorer=fuzz.WRatio,
+                                   processor=None, score_cutoff=score_cutoff)
+        result = self.names[match[2]] if match else None
+        self.results.put(key, result)
+        return result
+
+    def complete(self, query: str) -> List[str]:
+        """Up to max_choices names for what's been typed so far, best first."""
+        query = self.process_query(query)
+        key = ("complete", query)
+        if key in self.results:
+            return self.results.get(key)
+        words = query.split()
+        if not words:
+            result = sorted(self.names)[:self.max_choices]
+        else:
+            candidates = None
+            for word in words:
+                bucket = set(self.prefixes.get(word[:self.prefix_length], ()))
+                candidates = bucket if candidates is None else candidates & bucket
+            # the buckets only match the first few letters, so check the rest of each word
+            candidates = [i for i in sorted(candidates)
+                          if all(any(name_word.startswith(word) for name_word in self.processed[i].split()) for word in words)]
+            if candidates:
+                matches = process.extract(query, [self.processed[i] for i in candidates], scorer=fuzz.WRatio,
+                                          processor=None, limit=self.max_choices)
+                result = [self.names[candidates[i]] for choice, score, i in matches]
+            else:
+                # probably a typo, so score every name instead
+                matches = process.extract(query, self.processed, scorer=fuzz.WRatio, processor=None,
+                                          limit=self.max_choices, score_cutoff=50)
+                result = [self.names[i] for choice, score, i in matches]
+        self.results.put(key, result)
+        return result
 
 
 class Compat(commands.Cog, name="Compatibility Wiki"):
     def __init__(self, bot):
         self.bot = bot
-        self.search_dict = dict()
+        self.search_dict = self.build_search_dict()
+        self.search_index = TitleSearchIndex(self.search_dict)
+        self.game_ids = set(self.search_dict.values())
+
+    def build_search_dict(self) -> dict:
+        search_dict = dict()
         # create title search set
-        for ent in self.bot.title_ids:
-            if self.bot.title_ids[ent]["wiki_has_game_id_redirect"] and self.bot.title_ids[ent]["region"] != "JAP":
-                simple_name = re.sub(r"[^a-z0-9: ]+", '', self.bot.title_ids[ent]["game_title"].lower()).strip()
+        for ent, title in self.bot.title_ids.items():
+            if title["wiki_has_game_id_redirect"] and title["region"] != "JAP":
+                simple_name = re.sub(r"[^a-z0-9: ]+", '', title["game_title"].lower()).strip()
                 if ':' in simple_name:
                     # make games that have their title prefixed with the game's series searchable
-                    self.search_dict[simple_name.split(':')[0].strip()] = self.bot.title_ids[ent]["game_id"]
-                    self.search_dict[simple_name.split(':')[1].strip()] = self.bot.title_ids[ent]["game_id"]
+                    search_dict[simple_name.split(':')[0].strip()] = title["game_id"]
+                    search_dict[simple_name.split(':')[1].strip()] = title["game_id"]
                 else:
-                    self.search_dict[simple_name] = self.bot.title_ids[ent]["game_id"]
+                    search_dict[simple_name] = title["game_id"]
+        return search_dict
+
+    @commands.Cog.listener()
+    async def on_title_ids_swapped(self):
+        search_dict = self.build_search_dict()
+        self.search_dict, self.search_index, self.game_ids = search_dict, TitleSearchIndex(search_dict), set(search_dict.values())
 
     @app_commands.command(name="search", description="Search the Cemu compat wiki for the given game's compatibility page.")
     @app_commands.describe(game="The name of the game that you want to search for")
     async def search(self, inter: discord.Interaction, game: str):
+        # autocomplete choices send the game's ID
+        if game in self.game_ids:
+            await inter.response.send_message(content=f"The game's compatibility information can be found <https://wiki.cemu.info/wiki/{game}>")
+            return
         simple_hint = re.sub(r"[^a-z0-9 ]+", '', game.lower())
-        guess = process.extractOne(simple_hint, list(self.search_dict.keys()), score_cutoff=60)
+        guess = self.search_index.best(simple_hint)
         if guess is not None:
-            await inter.response.send_message(content=f"The game's compatibility information can be found <https://wiki.cemu.info/wiki/{self.search_dict[guess[0]]}>")
+            await inter.response.send_message(content=f"The game's compatibility information can be found <https://wiki.cemu.info/wiki/{self.search_dict[guess]}>")
         else:
             await inter.response.send_message(content=f"Couldn't find a good match for the game that you were searching for. Try viewing the compat wiki results <http://wiki.cemu.info/index.php?search={urllib.parse.quote_plus(simple_hint)}>")
 
+    @search.autocomplete("game")
+    async def search_autocomplete(self, inter: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+        # choice names and values can be at most 100 characters long, so the value is the game's ID instead of its name
+        return [app_commands.Choice(name=name[:100], value=self.search_dict[name]) for name in self.search_index.complete(current)]
+
 
 async def setup(bot):
     await bot.add_cog(Compat(bot))
\ No newline at end of file
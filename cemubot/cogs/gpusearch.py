@@ -1,13 +1,25 @@
+from . import config
+from .cache import LRUCache, atomic_write_json
+from .metrics import requests_hook
 from .utility import regex_group
 from abc import ABC
+from array import array
+import asyncio
 import concurrent.futures
+from discord.ext import commands, tasks
 import difflib
 import enum
+import heapq
 import json
+import math
 import re
 import requests
+import sys
+import threading
+import time
 import traceback
-from typing import Dict, List, Optional, Union
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
+from urllib.parse import quote
 
 
 class GPUAPI(enum.IntFlag):
@@ -17,13 +29,24 @@ class GPUAPI(enum.IntFlag):
 
 
 class APIVersion(ABC):
+    __slots__ = ()
+
     def __str__(self):
         pass
 
+    def pack(self) -> int:
+        """The version as a single integer, for compact storage."""
+        pass
+
+    @classmethod
+    def unpack(cls, code: int) -> "APIVersion":
+        pass
+
 
 class APIResult:
+    __slots__ = ("version", "url")
     version: APIVersion
-    url: Optional[str] = None
+    url: Optional[str]
 
     def __init__(self, version: APIVersion, url: str=None):
         self.version = version
@@ -34,6 +57,7 @@ class APIResult:
 
 
 class GLVersion(APIVersion):
+    __slots__ = ("major", "minor")
     major: int
     minor: int
 
@@ -44,8 +68,16 @@ class GLVersion(APIVersion):
     def __str__(self):
         return f"{self.major}.{self.minor}"
 
+    def pack(self) -> int:
+        return (self.major << 8) | self.minor
+
+    @classmethod
+    def unpack(cls, code: int) -> "GLVersion":
+        return cls(code >> 8, code & 0xFF)
+
 
 class VKVersion(APIVersion):
+    __slots__ = ("major", "minor", "patch")
     major: int
     minor: int
     patch: int
@@ -60,8 +92,17 @@ class VKVersion(APIVersion):
             return f"{self.major}.{self.minor}"
         return f"{self.major}.{self.minor}.{self.patch}"
 
+    def pack(self) -> int:
+        # the same layout as Vulkan's own VK_MAKE_VERSION
+        return (self.major << 22) | (self.minor << 12) | self.patch
+
+    @classmethod
+    def unpack(cls, code: int) -> "VKVersion":
+        return cls(code >> 22, (code >> 12) & 0x3FF, code & 0xFFF)
+
 
 class GPUSearchResult:
+    __slots__ = ("opengl", "vulkan")
     opengl: Optional[APIResult]
     vulkan: Optional[APIResult]
 
@@ -70,32 +111,598 @@ class GPUSearchResult:
         self.vulkan = vulkan
 
 
+def canonicalize_gpu(gpu: str) -> str:
+    """
+    Reduces a GPU name to the part that identifies the device, so that the different ways
+    that the OpenGL and Vulkan drivers (and the databases) spell it end up the same, e.g.
+    "NVIDIA GeForce RTX 3060/PCIe/SSE2" and "GeForce RTX 3060" both become "geforce rtx 3060".
+    """
+    gpu = re.sub(r"/(?:PCIe|PCI|AGP)(?:/SSE2)?|/SSE2|\((?:TM|R)\)|[™®]", "", gpu, flags=re.I)
+    # driver and renderer details, e.g. "(navi22, LLVM 13.0.0, DRM 3.42)" or "(KBL GT2)"
+    gpu = re.sub(r"\((?:[^()]*\b(?:LLVM|DRM|RADV|ACO|Mesa|Compatibility)\b[^()]*|\w+ GT\d\w*)\)", "", gpu, flags=re.I)
+    gpu = re.sub(r"\s(?:Series|Compatibility Profile Context.*)$", "", gpu.strip(), flags=re.I)
+    gpu = re.sub(r"^(?:(?:NVIDIA|AMD|ATI|Intel|Mesa|Qualcomm|ARM)\s+)+", "", gpu.strip(), flags=re.I)
+    return " ".join(gpu.lower().split())
+
+
+# vendor -> pattern that identifies its GPUs; these also have to work on canonicalize_gpu()'s output,
+# which drops vendor names like "NVIDIA" and "Intel" from the start of a name
+gpu_vendors = {
+    "nvidia": r"nvidia|geforce|quadro|tesla|titan|\bnvs\b",
+    "amd": r"\bamd\b|\bati\b|radeon|firepro|firegl",
+    "intel": r"intel|\b(?:u?hd|iris|xe|arc)\b.*\bgraphics\b|\barc\b",
+    "qualcomm": r"qualcomm|adreno",
+    "arm": r"\bmali\b|mali-",
+    "apple": r"\bapple\b",
+    "powervr": r"powervr|imagination",
+}
+
+gpu_vendor_regex = re.compile("|".join(f"(?P<{vendor}>{pattern})" for vendor, pattern in gpu_vendors.items()), re.I)
+mobile_gpu_regex = re.compile(r"mobile|max-q|laptop", re.I)
+
+def is_mobile_gpu(gpu: str) -> bool:
+    return bool(mobile_gpu_regex.search(gpu))
+
+def gpu_partition(gpu: str) -> Tuple[Optional[str], bool]:
+    """
+    Returns the vendor of a GPU name (the one whose pattern matches first, or None if there isn't one,
+    e.g. for a software renderer) and whether it's a mobile GPU.
+    """
+    vendor = gpu_vendor_regex.search(gpu)
+    return (vendor.lastgroup if vendor else None, is_mobile_gpu(gpu))
+
+
+class GPUNameIndex:
+    """
+    Inverted index of the device names in a GPU database, for fuzzy lookups.
+    Names (and queries) are compared in their canonicalize_gpu() form.
+    They're split into word and number tokens; a lookup gathers the names that share
+    the query's distinctive tokens (model numbers, mostly), ranks them by how much of both
+    names' IDF weight the shared tokens make up, and only scores the best few with difflib.
+    It usually picks the same name as difflib.get_close_matches(query, names, n=1);
+    when it doesn't, it's because difflib preferred a similar-looking but different model number.
+    """
+    # how many of the top-ranked candidates get scored with difflib
+    shortlist_size = 24
+    # tokens that are in more than this fraction of names (e.g. "geforce") aren't used to find candidates
+    common_fraction = 0.1
+
+    def __init__(self, names):
+        # canonical name -> the first database name with that canonical name
+        self.canonical: Dict[str, str] = {}
+        for name in names:
+            self.canonical.setdefault(canonicalize_gpu(name), name)
+        self.names: List[str] = list(self.canonical)
+        self.tokens = [frozenset(self.tokenize(name)) for name in self.names]
+        self.postings: Dict[str, List[int]] = {}
+        for i, tokens in enumerate(self.tokens):
+            for token in tokens:
+                self.postings.setdefault(token, []).append(i)
+        # tokens in every name still get a small weight, so that they count for something
+        self.idf = {token: math.log(len(self.names) / len(ids)) + 0.1 for token, ids in self.postings.items()}
+        self.weights = [sum(self.idf[token] for token in tokens) for tokens in self.tokens]
+        self.common = max(50, int(len(self.names) * self.common_fraction))
+
+    @staticmethod
+    def tokenize(name: str) -> List[str]:
+        # splitting letters from numbers makes "RTX3060" and "RTX 3060" share their tokens
+        return re.findall(r"[a-z]+|[0-9]+", name.lower())
+
+    def shortlist(self, query: str) -> List[str]:
+        """The names that are most likely to match query, best first."""
+        query_tokens = set(self.tokenize(query))
+        tokens = [token for token in query_tokens if token in self.postings]
+        rare = [token for token in tokens if len(self.postings[token]) <= self.common]
+        shared: Dict[int, float] = {}
+        for token in (rare or tokens):
+            weight = self.idf[token]
+            for i in self.postings[token]:
+                shared[i] = shared.get(i, 0.0) + weight
+        if rare:
+            # the common tokens still count towards the candidates' scores
+            for token in tokens:
+                if token not in rare:
+                    weight = self.idf[token]
+                    for i in shared:
+                        if token in self.tokens[i]:
+                            shared[i] += weight
+        # tokens that only one side has (including ones that no name has) count against a candidate
+        query_weight = sum(self.idf.get(token, math.log(len(self.names) + 1)) for token in query_tokens)
+        best = heapq.nlargest(self.shortlist_size, shared.items(),
+                              key=lambda item: item[1] / (query_weight + self.weights[item[0]]))
+        return [self.names[i] for i, score in best]
+
+    def search(self, query: str, cutoff: float=0.6) -> Optional[str]:
+        """
+        Returns the database name that's most similar to query,
+        or None if none are at least cutoff similar.
+        """
+        query = canonicalize_gpu(query)
+        if query in self.canonical:
+            return self.canonical[query]
+        candidates = self.shortlist(query)
+        if not candidates:
+            # nothing shares a token with the query, so fall back to scoring every name
+            matches = difflib.get_close_matches(query, self.names, n=1, cutoff=cutoff)
+            return self.canonical[matches[0]] if matches else None
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(query)
+        best = None
+        for name in candidates:
+            matcher.set_seq1(name)
+            # the quick ratios are upper bounds of ratio(), so they can rule out most candidates
+            # once a good match has been found
+            if matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff \
+            and (ratio := matcher.ratio()) >= cutoff and (best is None or (ratio, name) > best):
+                best = (ratio, name)
+                cutoff = ratio
+        return self.canonical[best[1]] if best else None
+
+
+class PartitionedGPUNameIndex:
+    """
+    GPUNameIndex split up by gpu_partition(), so that a query is only compared with the names
+    of the same vendor and class; this keeps a Radeon query from matching a GeForce name that
+    happens to look similar, and makes every index a fraction of the size.
+    If nothing of the same class matches, the other class of the same vendor is tried,
+    since mobile and desktop versions of a GPU support the same API versions.
+    """
+    def __init__(self, names):
+        partitions: Dict[Tuple[Optional[str], bool], List[str]] = {}
+        for name in names:
+            partitions.setdefault(gpu_partition(name), []).append(name)
+        self.partitions = {partition: GPUNameIndex(names) for partition, names in partitions.items()}
+
+    def search(self, query: str, cutoff: float=0.6) -> Optional[str]:
+        """
+        Returns the database name in query's partition that's most similar to query,
+        or None if none are at least cutoff similar.
+        """
+        vendor, mobile = gpu_partition(query)
+        for partition in ((vendor, mobile), (vendor, not mobile)):
+            if partition in self.partitions and (match := self.partitions[partition].search(query, cutoff)):
+                return match
+        return None
+
+
+class APIResultTable(Mapping):
+    """
+    Read-only mapping of device names to APIResults, for the GPU databases.
+    Instead of an APIResult, a version and a URL per device, it keeps each device's version
+    packed into an integer and its URL as a report ID after a prefix that every device shares;
+    the APIResult is built when it's looked up, and equal versions share one object.
+    """
+    # how a device's URL is stored; it's rebuilt as url_prefix plus:
+    URL_REPORT_ID = 0  # the number in report_ids
+    URL_NAME = 1       # the device's name
+    URL_QUOTED = 2     # the device's name, percent-encoded
+    URL_OTHER = 3      # a URL that doesn't fit the others, stored whole in other_urls
+
+    def __init__(self, version_type: type, url_prefix: str, rows: Iterable[Tuple[str, str, APIVersion]]=()):
+        self.version_type = version_type
+        self.url_prefix = sys.intern(url_prefix)
+        self.positions: Dict[str, int] = {}
+        self.names: List[str] = []
+        # "I" is 4 bytes, which fits packed versions and report IDs; "L" is 8 on 64-bit Linux
+        self.versions = array("I")
+        self.url_types = array("B")
+        self.report_ids = array("I")
+        self.other_urls: Dict[int, str] = {}
+        self.version_objects: Dict[int, APIVersion] = {}
+        for name, url, version in rows:
+            self.add(name, url, version)
+
+    def add(self, name: str, url: Optional[str], version: APIVersion) -> None:
+        """Adds a device, or replaces it if the name is already in the table."""
+        report_id = 0
+        suffix = url[len(self.url_prefix):] if url and url.startswith(self.url_prefix) else None
+        if suffix is None:
+            url_type = self.URL_OTHER
+        elif suffix.isdigit() and suffix == str(int(suffix)) and int(suffix) <= 0xFFFFFFFF:
+            url_type = self.URL_REPORT_ID
+            report_id = int(suffix)
+        elif suffix == name:
+            url_type = self.URL_NAME
+        elif suffix == quote(name):
+            url_type = self.URL_QUOTED
+        else:
+            url_type = self.URL_OTHER
+        if (position := self.positions.get(name)) is None:
+            position = self.positions[name] = len(self.names)
+            self.names.append(name)
+            self.versions.append(0)
+            self.url_types.append(0)
+            self.report_ids.append(0)
+        self.versions[position] = version.pack()
+        self.url_types[position] = url_type
+        self.report_ids[position] = report_id
+        if url_type == self.URL_OTHER:
+            self.other_urls[position] = url
+        else:
+            self.other_urls.pop(position, None)
+
+    def url(self, position: int) -> Optional[str]:
+        url_type = self.url_types[position]
+        if url_type == self.URL_REPORT_ID:
+            return f"{self.url_prefix}{self.report_ids[position]}"
+        if url_type == self.URL_NAME:
+            return self.url_prefix + self.names[position]
+        if url_type == self.URL_QUOTED:
+            return self.url_prefix + quote(self.names[position])
+        return self.other_urls[position]
+
+    def version(self, position: int) -> APIVersion:
+        code = self.versions[position]
+        if (version := self.version_objects.get(code)) is None:
+            version = self.version_objects[code] = self.version_type.unpack(code)
+        return version
+
+    def __getitem__(self, name: str) -> APIResult:
+        position = self.positions[name]
+        return APIResult(self.version(position), self.url(position))
+
+    def get(self, name: str, default=None):
+        position = self.positions.get(name)
+        return default if position is None else APIResult(self.version(position), self.url(position))
+
+    def __contains__(self, name) -> bool:
+        return name in self.positions
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.positions)
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+
+def iter_opengl_rows(chunks: Iterable[str]) -> Iterator[Tuple[str, str, str]]:
+    """
+    Yields (url, name, version) for every device in the table of opengl.gpuinfo.org/versionsupport.php,
+    reading the page a chunk at a time; only the rows that haven't been completed yet are kept in memory.
+    """
+    row_device = re.compile(r"<td class='firstrow'><a href='(displayreport\.php\?id=[^']+)'>(.+?)</a></td>", re.S)
+    row_version = re.compile(r"<td class='valuezeroleftblack'>(.+?)</td>", re.S)
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        start = 0
+        while (row_start := buffer.find("<tr>", start)) != -1 \
+        and (row_end := buffer.find("</tr>", row_start)) != -1:
+            row = buffer[row_start:row_end]
+            start = row_end + 5
+            if (device := row_device.search(row)) and (version := row_version.search(row, device.end())):
+                yield device.group(1), device.group(2), version.group(1)
+        # keep the unfinished row (or whatever's after the last row) for the next chunk
+        row_start = buffer.find("<tr>", start)
+        buffer = buffer[row_start:] if row_start != -1 else buffer[-3:]
+
+
+def iter_json_array(chunks: Iterable[str], key: str) -> Iterator:
+    """
+    Yields the items of the array at key in a JSON object, decoding one item at a time
+    as the chunks come in, instead of building the whole document first.
+    Assumes that key is the first member of the object with that name.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ""
+    position = None
+    finished = False
+    while True:
+        if position is None:
+            # look for the start of the array
+            if (match := re.search(r'"' + re.escape(key) + r'"\s*:\s*\[\s*', buffer)):
+                buffer = buffer[match.end():]
+                position = 0
+            else:
+                # the key could straddle the chunk boundary
+                buffer = buffer[-(len(key) + 64):]
+        else:
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\r\n,":
+                    position += 1
+                if buffer.startswith("]", position):
+                    return
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # most likely the item isn't complete yet
+                    if finished:
+                        raise
+                    break
+                yield item
+                position = end
+            buffer = buffer[position:]
+            position = 0
+        if finished:
+            raise ValueError(f"Couldn't find the end of the {key} array")
+        try:
+            buffer += next(chunks)
+        except StopIteration:
+            finished = True
+
+
+def iter_vulkan_rows(chunks: Iterable[str]) -> Iterator[Tuple[str, str, str]]:
+    """Yields (url, name, version) for every device in a vulkan.gpuinfo.org devices.php response."""
+    device_link = re.compile(r"<a href=\"(listreports\.php\?devicename=.*?)\">(.*?)</a>")
+    for device in iter_json_array(chunks, "data"):
+        if (link := device_link.search(device["device"])):
+            yield link.group(1), link.group(2), device["api"]
+
+
+class GPUDatabase:
+    """
+    The OpenGL and Vulkan databases from gpuinfo.org, along with their name indexes.
+    A database is never modified after it's created; GPUInfoSearch replaces it as a whole
+    when it's refreshed, so searches always see both halves of the same version.
+    The halves can be refreshed separately, so each one keeps track of when it was downloaded.
+    """
+    # bump this whenever the snapshot layout changes, so that old snapshots are ignored
+    snapshot_format = 2
+    # the part of the URLs that every device in a database shares
+    opengl_url_prefix = "https://opengl.gpuinfo.org/displayreport.php?id="
+    vulkan_url_prefix = "https://vulkan.gpuinfo.org/listreports.php?devicename="
+
+    def __init__(self, opengl: Optional[Mapping[str, APIResult]]=None, vulkan: Optional[Mapping[str, APIResult]]=None,
+                 opengl_created: Optional[float]=None, vulkan_created: Optional[float]=None):
+        self.opengl = opengl
+        self.vulkan = vulkan
+        self.opengl_index = PartitionedGPUNameIndex(opengl.keys()) if opengl else None
+        self.vulkan_index = PartitionedGPUNameIndex(vulkan.keys()) if vulkan else None
+        # when each database was downloaded (now, if not given), or None if it's missing
+        now = time.time()
+        self.opengl_created = (opengl_created if opengl_created is not None else now) if opengl else None
+        self.vulkan_created = (vulkan_created if vulkan_created is not None else now) if vulkan else None
+
+    @property
+    def complete(self) -> bool:
+        return bool(self.opengl) and bool(self.vulkan)
+
+    @property
+    def version(self) -> List[Optional[float]]:
+        """Changes whenever either database does."""
+        return [self.opengl_created, self.vulkan_created]
+
+    def stale(self, max_age: float) -> GPUAPI:
+        """The APIs whose databases are missing or were downloaded more than max_age seconds ago."""
+        now = time.time()
+        return GPUAPI((GPUAPI.OpenGL if self.opengl_created is None or now - self.opengl_created >= max_age else 0)
+                      | (GPUAPI.Vulkan if self.vulkan_created is None or now - self.vulkan_created >= max_age else 0))
+
+    @classmethod
+    def download(cls, opengl: bool=True, vulkan: bool=True) -> "GPUDatabase":
+        """Downloads the given databases; one that wasn't requested or couldn't be downloaded is None."""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            opengl = executor.submit(GPUInfoSearch.cache_opengl) if opengl else None
+            vulkan = executor.submit(GPUInfoSearch.cache_vulkan) if vulkan else None
+            return cls(opengl and opengl.result(), vulkan and vulkan.result())
+
+    @classmethod
+    def load(cls, path: str) -> Optional["GPUDatabase"]:
+        """Loads a snapshot written by save(); returns None if it's missing, corrupt or outdated."""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            if snapshot.get("format") != cls.snapshot_format:
+                return None
+            opengl = APIResultTable(GLVersion, cls.opengl_url_prefix, (
+                (name, url, GLVersion(major, minor)) for name, url, major, minor in snapshot["opengl"]
+            )) if snapshot["opengl"] else None
+            vulkan = APIResultTable(VKVersion, cls.vulkan_url_prefix, (
+                (name, url, VKVersion(major, minor, patch)) for name, url, major, minor, patch in snapshot["vulkan"]
+            )) if snapshot["vulkan"] else None
+            return cls(opengl, vulkan, snapshot["opengl_created"], snapshot["vulkan_created"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, path: str) -> None:
+        atomic_write_json(path, {
+            "format": self.snapshot_format,
+            "opengl_created": self.opengl_created,
+            "vulkan_created": self.vulkan_created,
+            "opengl": [[name, result.url, result.version.major, result.version.minor]
+                       for name, result in self.opengl.items()] if self.opengl else None,
+            "vulkan": [[name, result.url, result.version.major, result.version.minor, result.version.patch]
+                       for name, result in self.vulkan.items()] if self.vulkan else None
+        }, separators=(",", ":"))
+
+
+class CircuitBreaker:
+    """
+    Stops requests to an upstream that keeps failing.
+    After failure_threshold consecutive failures, allow() returns False for reset_timeout seconds;
+    after that, requests are let through again until one fails (which reopens the breaker) or succeeds.
+    """
+    def __init__(self, failure_threshold: int=3, reset_timeout: float=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            return self.opened_at is None or time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+
 class GPUSearchModule(ABC):
     def search(self, gpu: str, api: GPUAPI = GPUAPI.Both) -> GPUSearchResult:
         pass
 
+    def search_many(self, gpus: Iterable[str], api: GPUAPI = GPUAPI.Both) -> List[GPUSearchResult]:
+        """
+        Searches for every GPU in gpus, returning the results in the same order.
+        Each distinct GPU is only searched for once, and duplicates share their result.
+        """
+        gpus = list(gpus)
+        results = {gpu: self.search(gpu, api) for gpu in dict.fromkeys(gpus)}
+        return [results[gpu] for gpu in gpus]
 
-class GPUInfoSearch(GPUSearchModule):
-    """GPUSearchModule implementation using gpuinfo.org as the database."""
-    opengl_cache: Optional[Dict[str, APIResult]] = None
-    vulkan_cache: Optional[Dict[str, APIResult]] = None
 
-    def __init__(self, init_cache: bool=True):
-        if init_cache:
+class GPUInfoSearch(GPUSearchModule):
+    """
+    GPUSearchModule implementation using gpuinfo.org as the database.
+    The databases are loaded from a snapshot on disk if there is one, so that startup doesn't
+    have to wait for gpuinfo.org; the GPUSearch cog refreshes them in the background.
+
+    If a database is missing (e.g. gpuinfo.org was down when there was no snapshot yet),
+    searches run in a degraded mode: a download of the missing database is started in the background,
+    OpenGL lookups return None until it's done, and Vulkan lookups use the database's search API.
+    Every request goes through a circuit breaker, and failed lookups are cached for a while,
+    so an outage never turns each parse into a string of slow requests.
+    """
+    # lookups that were answered by the memo or an exact name, and ones that weren't
+    hits: int = 0
+    misses: int = 0
+    # how often (in seconds) new memo entries are written to disk
+    memo_save_interval = 60
+    # bump this whenever the memo's keys or entries change, so that old memo files are ignored
+    memo_format = 2
+    # how long (in seconds) degraded mode lookups are cached, for results and for failures/no results
+    degraded_ttl = 60 * 60
+    negative_ttl = 10 * 60
+    # timeout (in seconds) of a degraded mode lookup, and (connect, read) timeouts of database downloads
+    query_timeout = 5
+    download_timeout = (10, 60)
+
+    def __init__(self, init_cache: bool=True, memo_path: Optional[str]="misc/cache/gpu_memo.json", memo_size: int=4096,
+                 snapshot_path: Optional[str]="misc/cache/gpu_snapshot.json", backfill: bool=True):
+        self.snapshot_path = snapshot_path
+        self.database = (GPUDatabase.load(snapshot_path) if snapshot_path else None) or GPUDatabase()
+        # if backfill is set, searches start downloading the missing databases in the background
+        self.backfill = backfill
+        self.breaker = CircuitBreaker()
+        self.refresh_lock = threading.Lock()
+        # (api, canonical GPU name) -> (expiry time, result) for degraded mode lookups
+        self.degraded = LRUCache(1024)
+        # called (from whichever thread did the swap) after swap_database() installs new databases
+        self.on_swap: Optional[Callable[[], None]] = None
+        # memo_key() -> {"query": GPU name, "opengl": database name or None, "vulkan": ...} for previous lookups;
+        # storing names instead of results keeps it valid when the databases are reloaded
+        self.memo = LRUCache(memo_size)
+        self.memo_path = memo_path
+        self.memo_saved = time.monotonic()
+        self.load_memo()
+        if init_cache and not self.database.complete:
             self.init_cache()
 
+    @property
+    def opengl_cache(self) -> Optional[Mapping[str, APIResult]]:
+        return self.database.opengl
+
+    @opengl_cache.setter
+    def opengl_cache(self, cache: Optional[Mapping[str, APIResult]]):
+        self.database = GPUDatabase(cache, self.database.vulkan, vulkan_created=self.database.vulkan_created)
+
+    @property
+    def vulkan_cache(self) -> Optional[Mapping[str, APIResult]]:
+        return self.database.vulkan
+
+    @vulkan_cache.setter
+    def vulkan_cache(self, cache: Optional[Mapping[str, APIResult]]):
+        self.database = GPUDatabase(self.database.opengl, cache, opengl_created=self.database.opengl_created)
+
     def init_cache(self):
         """Initialize the internal OpenGL and Vulkan database caches."""
         try:
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                futures = [executor.submit(GPUInfoSearch.cache_opengl),
-                            executor.submit(GPUInfoSearch.cache_vulkan)]
-                self.opengl_cache = futures[0].result()
-                self.vulkan_cache = futures[1].result()
+            self.swap_database(GPUDatabase.download())
         except Exception as e:
             print(f"Database cache could not be initialized")
             traceback.print_exc()
 
+    def swap_database(self, database: GPUDatabase) -> bool:
+        """
+        Replaces the current databases with the given ones and saves them as the new snapshot.
+        A database that failed to download (or wasn't downloaded) is kept from the current version instead,
+        along with when it was downloaded.
+        Returns False (and changes nothing) if neither database was downloaded.
+        """
+        if not database.opengl and not database.vulkan:
+            return False
+        if not database.complete:
+            current = self.database
+            database = GPUDatabase(database.opengl or current.opengl, database.vulkan or current.vulkan,
+                                   database.opengl_created if database.opengl else current.opengl_created,
+                                   database.vulkan_created if database.vulkan else current.vulkan_created)
+        # a single assignment, so searches on other threads see either the old or the new version
+        self.database = database
+        # better matches might exist now, so look up the memoized GPUs again (most recently used last);
+        # only in the databases that are there, since degraded mode lookups would make requests
+        previous = [value["query"] for key, value in self.memo.items()]
+        self.memo.clear()
+        available = (GPUAPI.OpenGL if database.opengl else 0) | (GPUAPI.Vulkan if database.vulkan else 0)
+        if available:
+            self.search_many(previous, GPUAPI(available))
+        if self.snapshot_path:
+            try:
+                database.save(self.snapshot_path)
+            except OSError:
+                traceback.print_exc()
+        self.save_memo()
+        if self.on_swap:
+            self.on_swap()
+        return True
+
+    def refresh(self, api: GPUAPI = GPUAPI.Both, missing_only: bool=False) -> bool:
+        """
+        Downloads the databases of the given APIs (or only the missing ones) and swaps them in.
+        Only one refresh runs at a time, and none run while the circuit breaker is open;
+        returns False if the refresh was skipped or failed.
+        """
+        if not self.breaker.allow() or not self.refresh_lock.acquire(blocking=False):
+            return False
+        try:
+            database = self.database
+            opengl = bool(api & GPUAPI.OpenGL) and not (missing_only and database.opengl)
+            vulkan = bool(api & GPUAPI.Vulkan) and not (missing_only and database.vulkan)
+            downloaded = GPUDatabase.download(opengl=opengl, vulkan=vulkan)
+            if not self.swap_database(downloaded):
+                self.breaker.record_failure()
+                return False
+            # a refresh that left a database missing (or stale) counts as a failure
+            if self.database.complete and (downloaded.opengl or not opengl) and (downloaded.vulkan or not vulkan):
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+            return True
+        finally:
+            self.refresh_lock.release()
+
+    def request_backfill(self) -> None:
+        """Starts downloading the missing databases in the background, unless that's already happening."""
+        if self.backfill and self.breaker.allow() and not self.refresh_lock.locked():
+            threading.Thread(target=self.refresh, kwargs={"missing_only": True},
+                             name="gpu-backfill", daemon=True).start()
+
+    def _search_vulkan_degraded(self, gpu: str) -> Optional[APIResult]:
+        """Vulkan lookup for when the database is missing; see the class docstring."""
+        key = canonicalize_gpu(gpu)
+        if (entry := self.degraded.get(key)) is not None and entry[0] > time.time():
+            return entry[1]
+        if not self.breaker.allow():
+            return None
+        try:
+            result = GPUInfoSearch.query_vulkan(gpu, timeout=self.query_timeout)
+        # an unexpected response counts as a failure too, so that a broken API trips the breaker
+        except (requests.exceptions.RequestException, ValueError, KeyError, AttributeError, TypeError):
+            self.breaker.record_failure()
+            result = None
+        else:
+            self.breaker.record_success()
+        self.degraded.put(key, (time.time() + (self.degraded_ttl if result else self.negative_ttl), result))
+        return result
+
     @staticmethod
     def jsonToQueryString(json: Dict) -> str:
         def recurse(obj: Union[Dict, List], parent: str="") -> List:
@@ -110,28 +717,24 @@ class GPUInfoSearch(GPUSearchModule):
         return '?' + '&'.join(recurse(json))
 
     @staticmethod
-    def cache_opengl() -> Optional[Dict[str, APIResult]]:
+    def cache_opengl() -> Optional[Mapping[str, APIResult]]:
         """Returns a cache of the OpenGL version database for offline usage."""
+        result = APIResultTable(GLVersion, GPUDatabase.opengl_url_prefix)
         try:
-            req = requests.get("https://opengl.gpuinfo.org/versionsupport.php")
-        except requests.exceptions.RequestException:
+            with requests.get("https://opengl.gpuinfo.org/versionsupport.php", stream=True,
+                              timeout=GPUInfoSearch.download_timeout, hooks={"response": requests_hook}) as req:
+                if req.status_code != 200:
+                    return None
+                req.encoding = req.encoding or "utf-8"
+                for url, name, version in iter_opengl_rows(req.iter_content(64 * 1024, decode_unicode=True)):
+                    version = version.split(".")
+                    result.add(name, f"https://opengl.gpuinfo.org/{url}", GLVersion(int(version[0]), int(version[1])))
+        except (requests.exceptions.RequestException, ValueError):
             return None
-        if req.status_code != 200:
-            return None
-        # (url, name, gl_version)
-        devices = re.findall(
-            r"<tr>.*?<td class='firstrow'><a href='(displayreport\.php\?id=.+?)'>(.+?)</a></td>.*?<td class='valuezeroleftblack'>(.+?)</td>.*?</tr>",
-            req.text, re.S)
-        result: Dict[str, APIResult] = {}
-        for device in devices:
-            version = device[2].split(".")
-            result[device[1]] = APIResult(
-                GLVersion(int(version[0]), int(version[1])),
-                f"https://opengl.gpuinfo.org/{device[0]}")
         return result
 
     @staticmethod
-    def cache_vulkan() -> Optional[Dict[str, APIResult]]:
+    def cache_vulkan() -> Optional[Mapping[str, APIResult]]:
         """Returns a cache of the Vulkan version database for offline usage."""
         query = {
             "platform": "all",
@@ -151,46 +754,28 @@ class GPUInfoSearch(GPUSearchModule):
             ]
         }
         query_str = GPUInfoSearch.jsonToQueryString(query)
+        result = APIResultTable(VKVersion, GPUDatabase.vulkan_url_prefix)
         try:
-            req = requests.get(f"https://vulkan.gpuinfo.org/api/internal/devices.php{query_str}")
-        except requests.exceptions.RequestException:
+            with requests.get(f"https://vulkan.gpuinfo.org/api/internal/devices.php{query_str}", stream=True,
+                              timeout=GPUInfoSearch.download_timeout, hooks={"response": requests_hook}) as req:
+                if req.status_code != 200:
+                    return None
+                req.encoding = req.encoding or "utf-8"
+                for url, name, version in iter_vulkan_rows(req.iter_content(64 * 1024, decode_unicode=True)):
+                    version = version.split(".")
+                    result.add(name, f"https://vulkan.gpuinfo.org/{url}",
+                               VKVersion(int(version[0]), int(version[1]), int(version[2])))
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError):
             return None
-        if req.status_code != 200:
-            return None
-        devices = json.loads(req.text)["data"]
-        result: Dict[str, APIResult] = {}
-        for device in devices:
-            temp = re.search(r"<a href=\"(listreports\.php\?devicename=.*?)\">(.*?)</a>", device["device"])
-            version = device["api"].split(".")
-            result[temp.group(2)] = APIResult(
-                VKVersion(int(version[0]), int(version[1]), int(version[2])),
-                f"https://vulkan.gpuinfo.org/{temp.group(1)}"
-            )
         return result
 
     @staticmethod
-    def search_opengl_nocache(gpu: str) -> Optional[APIResult]:
-        try:
-            req = requests.get("https://opengl.gpuinfo.org/versionsupport.php")
-        except requests.exceptions.RequestException:
-            return None
-        if req.status_code != 200:
-            return None
-        # (url, name, gl_version)
-        results = re.findall(
-            r"<tr>.*?<td class='firstrow'><a href='(displayreport\.php\?id=.+?)'>(.+?)</a></td>.*?<td class='valuezeroleftblack'>(.+?)</td>.*?</tr>",
-            req.text, re.S)
-        if results:
-            result = sorted(results,
-                key=lambda x: difflib.SequenceMatcher(None, x[1], gpu).ratio(),
-                reverse=True)
-            result = result[0]
-            ver = result[2].split(".")
-            return APIResult(GLVersion(int(ver[0]), int(ver[1])), f"https://opengl.gpuinfo.org/{result[0]}")
-        return None
-
-    @staticmethod
-    def search_vulkan_nocache(gpu: str) -> Optional[APIResult]:
+    def query_vulkan(gpu: str, timeout: Optional[float]=None) -> Optional[APIResult]:
+        """
+        Looks up a single device with the Vulkan database's search API.
+        Returns None if nothing matched; raises RequestException if the request failed,
+        or ValueError, KeyError, AttributeError or TypeError if the response wasn't what was expected.
+        """
         gpu_stripped = re.sub(
             r"/?(?:PCIe|)/?SSE2",
             "", gpu
@@ -221,12 +806,8 @@ class GPUInfoSearch(GPUSearchModule):
         }
         query_str = GPUInfoSearch.jsonToQueryString(query)
         url = f"https://vulkan.gpuinfo.org/api/internal/devices.php{query_str}"
-        try:
-            req = requests.get(url)
-        except requests.exceptions.RequestException:
-            return None
-        if req.status_code != 200:
-            return None
+        req = requests.get(url, timeout=timeout, hooks={"response": requests_hook})
+        req.raise_for_status()
         result = json.loads(req.text)
         if result["data"]:
             result = result["data"]
@@ -246,46 +827,87 @@ class GPUInfoSearch(GPUSearchModule):
                 f"https://vulkan.gpuinfo.org/{matches[0]['device']['url']}")
         return None
 
-    def _search_cache(self, gpu: str, api: GPUAPI = GPUAPI.Both) -> GPUSearchResult:
+    def load_memo(self) -> None:
+        if not self.memo_path:
+            return
+        try:
+            with open(self.memo_path, "r", encoding="utf-8") as f:
+                memo = json.load(f)
+        except (OSError, ValueError):
+            return
+        # a memo of a different database version could be missing better matches
+        if (not isinstance(memo, dict) or memo.get("format") != self.memo_format
+                or memo.get("database") != self.database.version):
+            return
+        # entries are stored from least to most recently used
+        for key, value in memo["entries"]:
+            self.memo.put(key, value)
+
+    def save_memo(self) -> None:
+        self.memo_saved = time.monotonic()
+        if not self.memo_path:
+            return
+        try:
+            atomic_write_json(self.memo_path, {"format": self.memo_format, "database": self.database.version,
+                                                "entries": self.memo.items()})
+        except OSError:
+            traceback.print_exc()
+
+    @staticmethod
+    def memo_key(gpu: str) -> str:
+        # spellings of a GPU only share a memo entry if the index would search the same partition for them
+        vendor, mobile = gpu_partition(gpu)
+        return f"{vendor or ''}:{'mobile' if mobile else 'desktop'}:{canonicalize_gpu(gpu)}"
+
+    def _search_cache(self, gpu: str, api: GPUAPI, database: GPUDatabase) -> GPUSearchResult:
         result: GPUSearchResult = GPUSearchResult()
-        if api & GPUAPI.OpenGL:
-            if (temp := self.opengl_cache.get(gpu)):
-                result.opengl = temp
+        key = self.memo_key(gpu)
+        # the query is kept so that swap_database() can search for it again
+        memo = self.memo.get(key) or {"query": gpu}
+        updated = False
+        for flag, field, cache, index in ((GPUAPI.OpenGL, "opengl", database.opengl, database.opengl_index),
+                                          (GPUAPI.Vulkan, "vulkan", database.vulkan, database.vulkan_index)):
+            if not api & flag:
+                continue
+            if (temp := cache.get(gpu)):
+                self.hits += 1
+                setattr(result, field, temp)
+                continue
+            # the memoized name could be missing if the database changed since it was stored
+            if field in memo and (memo[field] is None or memo[field] in cache):
+                self.hits += 1
+                match = memo[field]
             else:
-                matches = difflib.get_close_matches(gpu, self.opengl_cache.keys())
-                result.opengl = self.opengl_cache.get(matches[0]) if matches else None
-        if api & GPUAPI.Vulkan:
-            if (temp := self.vulkan_cache.get(gpu)):
-                result.vulkan = temp
-            else:
-                gpu_stripped = re.sub(r"/?(?:PCIe|)/?SSE2", "", gpu)
-                matches = difflib.get_close_matches(gpu_stripped, self.vulkan_cache.keys())
-                result.vulkan = self.vulkan_cache.get(matches[0]) if matches else None
+                self.misses += 1
+                match = index.search(gpu)
+                # copy, since the memo entry could be getting saved by another thread
+                memo = {**memo, field: match}
+                updated = True
+            setattr(result, field, cache.get(match) if match else None)
+        if updated:
+            self.memo.put(key, memo)
+            if time.monotonic() - self.memo_saved > self.memo_save_interval:
+                self.save_memo()
         return result
 
     def search(self, gpu: str, api: GPUAPI = GPUAPI.Both) -> GPUSearchResult:
-        result: GPUSearchResult = GPUSearchResult()
-        if self.opengl_cache and self.vulkan_cache:
-            result = self._search_cache(gpu, api)
-        elif self.opengl_cache and not self.vulkan_cache:
-            if api & GPUAPI.OpenGL:
-                result.opengl = self._search_cache(gpu, GPUAPI.OpenGL).opengl
-            if api & GPUAPI.Vulkan:
-                result.vulkan = GPUInfoSearch.search_vulkan_nocache(gpu)
-        elif self.vulkan_cache and not self.opengl_cache:
-            if api & GPUAPI.Vulkan:
-                result.vulkan = self._search_cache(gpu, GPUAPI.Vulkan).vulkan
-            if api & GPUAPI.OpenGL:
-                result.opengl = GPUInfoSearch.search_opengl_nocache(gpu)
+        # the database could be swapped out by a refresh at any point, so only read it once
+        return self._search(gpu, api, self.database)
+
+    def _search(self, gpu: str, api: GPUAPI, database: GPUDatabase) -> GPUSearchResult:
+        available = (GPUAPI.OpenGL if database.opengl else 0) | (GPUAPI.Vulkan if database.vulkan else 0)
+        if api & available:
+            result = self._search_cache(gpu, api & available, database)
         else:
-            futures = []
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                futures = [executor.submit(GPUInfoSearch.search_opengl_nocache, gpu),
-                           executor.submit(GPUInfoSearch.search_vulkan_nocache, gpu)]
-            if api & GPUAPI.OpenGL:
-                result.opengl = futures[0].result()
-            if api & GPUAPI.Vulkan:
-                result.vulkan = futures[1].result()
+            result = GPUSearchResult()
+        if api & ~available:
+            self.request_backfill()
+        # there's no way to look up a single device in the OpenGL database, so that waits for the backfill
+        if api & GPUAPI.OpenGL and not database.opengl:
+            self.misses += 1
+        if api & GPUAPI.Vulkan and not database.vulkan:
+            self.misses += 1
+            result.vulkan = self._search_vulkan_degraded(gpu)
         return result
 
 
@@ -301,7 +923,7 @@ class TechPowerUpSearch(GPUSearchModule):
             "", query
         )
         try:
-            req = requests.get(f"https://www.techpowerup.com/gpu-specs/?ajaxsrch={revised_query}")
+            req = requests.get(f"https://www.techpowerup.com/gpu-specs/?ajaxsrch={revised_query}", hooks={"response": requests_hook})
         except requests.exceptions.RequestException:
             return None
         req = req.text
@@ -315,7 +937,7 @@ class TechPowerUpSearch(GPUSearchModule):
         try:
             matches = [
                 x for x in difflib.get_close_matches(query, results.keys())
-                if not (bool(re.search(r"mobile|max-q", query, re.I)) ^ bool(re.search(r"mobile|max-q", x, re.I)))
+                if not (is_mobile_gpu(query) ^ is_mobile_gpu(x))
             ]
             if results[matches[0]]:
                 return f"https://www.techpowerup.com{results[matches[0]]}"
@@ -327,7 +949,7 @@ class TechPowerUpSearch(GPUSearchModule):
     def get_html(url: str) -> Optional[str]:
         if url:
             try:
-                req = requests.get(url)
+                req = requests.get(url, hooks={"response": requests_hook})
             except requests.exceptions.RequestException:
                 return None
             if req.status_code == 200:
@@ -354,3 +976,37 @@ class TechPowerUpSearch(GPUSearchModule):
                 vk = vk.split(".")
                 result.vulkan = APIResult(VKVersion(int(vk[0]), int(vk[1]), 0), url)
         return result
+
+
+class GPUSearch(commands.Cog):
+    """Keeps the bot's gpuinfo.org databases up to date in the background."""
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if not self.refresh_databases.is_running():
+            self.refresh_databases.start()
+
+    def cog_unload(self):
+        self.refresh_databases.cancel()
+
+    # often enough that a missing database is retried soon, even if no searches request a backfill
+    @tasks.loop(minutes=10.0)
+    async def refresh_databases(self):
+        search_module = self.bot.search_module
+        if not isinstance(search_module, GPUInfoSearch):
+            return
+        max_age = config.cfg.get("gpu_database_max_age", 24 * 60 * 60)
+        # the databases are refreshed separately, since a refresh could have only downloaded one of them
+        stale = search_module.database.stale(max_age)
+        if not stale:
+            return
+        # downloading and indexing the databases takes a while, so keep it off the event loop;
+        # the bot is notified of the swap through search_module.on_swap
+        if not await asyncio.get_running_loop().run_in_executor(None, search_module.refresh, stale):
+            print("Failed to refresh the GPU databases; keeping the current ones.")
+
+
+async def setup(bot):
+    await bot.add_cog(GPUSearch(bot))
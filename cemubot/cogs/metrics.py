@@ -0,0 +1,243 @@
+# bot metrics in the Prometheus text format, served on localhost by the Metrics cog
+# if "metrics_port" is set in the config
+from aiohttp import web
+import aiohttp
+from discord.ext import commands
+import math
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from cogs import config
+
+
+def format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str="") -> str:
+    labels = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...]=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.lock = threading.Lock()
+
+    def label_values(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """Returns (name suffix, formatted labels, value) for every sample of this metric."""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...]=()):
+        super().__init__(name, help, labelnames)
+        # a counter without labels always has exactly one sample, so report it from the start
+        self.values: Dict[Tuple[str, ...], float] = {} if labelnames else {(): 0}
+
+    def inc(self, amount: float=1, **labels) -> None:
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [("", format_labels(self.labelnames, key), value) for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    type = "histogram"
+    default_buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...]=(), buckets: Tuple[float, ...]=default_buckets):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+        # label values -> (bucket counts, sum)
+        self.values: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.label_values(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        result = []
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    result.append(("_bucket", format_labels(self.labelnames, key, f'le="{format_value(bound)}"'), cumulative))
+                result.append(("_sum", format_labels(self.labelnames, key), total))
+                result.append(("_count", format_labels(self.labelnames, key), cumulative))
+        return result
+
+
+class CallbackMetric(Metric):
+    """A metric whose values are read from somewhere else whenever it's scraped."""
+    def __init__(self, name: str, help: str, type: str, labelnames: Tuple[str, ...],
+                 callback: Callable[[], Dict[Tuple[str, ...], Optional[float]]]):
+        super().__init__(name, help, labelnames)
+        self.type = type
+        self.callback = callback
+
+    def samples(self):
+        return [("", format_labels(self.labelnames, key), value)
+                for key, value in self.callback().items() if value is not None]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+registry = Registry()
+logs_detected = registry.register(Counter(
+    "cemubot_logs_detected_total", "Logs that were posted in a parsing channel and passed the log check"))
+logs_parsed = registry.register(Counter(
+    "cemubot_logs_parsed_total", "Logs that finished parsing, by result (ok, no_game or crashed)", ("result",)))
+logs_failed = registry.register(Counter(
+    "cemubot_logs_failed_total", "Logs whose parse threw an exception"))
+parse_seconds = registry.register(Histogram(
+    "cemubot_parse_seconds", "Time from taking a log off the queue to having its results", ("cached",)))
+http_request_seconds = registry.register(Histogram(
+    "cemubot_http_request_seconds", "Latency of HTTP requests to each upstream", ("upstream",)))
+
+# hostname suffix -> upstream label
+upstreams = {
+    "pastebin.com": "pastebin",
+    "discordapp.com": "discord",
+    "discordapp.net": "discord",
+    "wiki.cemu.info": "wiki",
+    "cemu.info": "cemu.info",
+    "gpuinfo.org": "gpuinfo",
+    "techpowerup.com": "techpowerup",
+    "wiiubrew.org": "wiiubrew",
+}
+
+def upstream_of(url) -> str:
+    host = urlsplit(str(url)).hostname or ""
+    for suffix, upstream in upstreams.items():
+        if host == suffix or host.endswith("." + suffix):
+            return upstream
+    return "other"
+
+
+def requests_hook(response, *args, **kwargs):
+    """requests response hook; use with hooks={"response": requests_hook} or Session.hooks."""
+    http_request_seconds.observe(response.elapsed.total_seconds(), upstream=upstream_of(response.url))
+
+
+def trace_config() -> aiohttp.TraceConfig:
+    """Returns a TraceConfig that records the latency of an aiohttp.ClientSession's requests."""
+    async def on_request_start(session, context, params):
+        context.start = time.perf_counter()
+    async def on_request_end(session, context, params):
+        http_request_seconds.observe(time.perf_counter() - context.start, upstream=upstream_of(params.url))
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    trace.on_request_exception.append(on_request_end)
+    return trace
+
+
+def hit_ratio(hits: int, misses: int) -> Optional[float]:
+    return hits / (hits + misses) if hits + misses else None
+
+
+class Metrics(commands.Cog):
+    """
+    Serves /metrics on 127.0.0.1:<metrics_port>; does nothing if "metrics_port" isn't set.
+    In "process" parse executor mode, the GPU and wiki caches (and their requests)
+    live in the worker processes, so only the bot process's own numbers are reported.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self.runner: Optional[web.AppRunner] = None
+        registry.register(CallbackMetric(
+            "cemubot_parse_queue_depth", "Logs that are waiting to be parsed or being parsed", "gauge", (),
+            lambda: {(): len(self.bot.parse_scheduler)}))
+        registry.register(CallbackMetric(
+            "cemubot_gateway_latency_seconds", "Discord gateway heartbeat latency", "gauge", (),
+            lambda: {(): self.bot.latency if math.isfinite(self.bot.latency) else None}))
+        registry.register(CallbackMetric(
+            "cemubot_cache_hits_total", "Lookups that were answered by each cache", "counter", ("cache",),
+            lambda: {(cache,): hits for cache, (hits, misses) in self.cache_stats().items()}))
+        registry.register(CallbackMetric(
+            "cemubot_cache_misses_total", "Lookups that each cache couldn't answer", "counter", ("cache",),
+            lambda: {(cache,): misses for cache, (hits, misses) in self.cache_stats().items()}))
+        registry.register(CallbackMetric(
+            "cemubot_cache_hit_ratio", "Hits divided by lookups for each cache", "gauge", ("cache",),
+            lambda: {(cache,): hit_ratio(hits, misses) for cache, (hits, misses) in self.cache_stats().items()}))
+
+    def cache_stats(self) -> Dict[str, Tuple[int, int]]:
+        return {
+            "result": (self.bot.parse_cache.hits, self.bot.parse_cache.misses),
+            "wiki": (self.bot.wiki_cache.hits, self.bot.wiki_cache.misses),
+            "gpu": (getattr(self.bot.search_module, "hits", 0), getattr(self.bot.search_module, "misses", 0)),
+        }
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # cogs are loaded before bot.run() starts the bot's own event loop,
+        # so the server can't be started any earlier than this
+        if self.runner is None:
+            await self.start_server()
+
+    async def start_server(self):
+        port = config.cfg.get("metrics_port", 0)
+        if not port:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self.metrics)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        # only listen on localhost; put a reverse proxy in front of it to expose it
+        await web.TCPSite(self.runner, "127.0.0.1", port).start()
+
+    async def cog_unload(self):
+        # Bot.close() unloads the extensions, so this also runs when the bot shuts down
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=registry.render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def setup(bot):
+    await bot.add_cog(Metrics(bot))
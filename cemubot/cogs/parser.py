@@ -1,8 +1,12 @@
 from .gpusearch import GPUSearchModule, GPUInfoSearch, GPUSearchResult
 from .utility import regex_group, regex_match
+from .timings import ParseTimings
+from .wiki import CompatIndex, WikiPageCache
 from difflib import get_close_matches
+import os
 import re
-import requests
+import time
+from typing import Dict, List, Optional, Tuple
 
 
 def default(fallback):
@@ -20,6 +24,156 @@ def name(string=None):
         return func
     return decorator_func
 
+def depends(*fields):
+    """
+    Declares the fields that a field function always reads; they're evaluated before it runs.
+    Fields that are only read some of the time don't need to be declared,
+    since they're evaluated whenever they're first read anyway.
+    """
+    def decorator_func(func):
+        func.depends = fields
+        return func
+    return decorator_func
+
+class LogPatternSet:
+    """
+    Every pattern that a set of rulesets looks for in the log, for {RulesetParser}.
+    Takes a list of keys, which are ("literal", string) or ("regex", pattern);
+    scan() returns the set of keys that a log contains.
+    Literals that share a long enough prefix are found together: the shared prefix is searched
+    for once, and the literals are only compared wherever it occurs, so e.g. any number of
+    ".../Mods/<graphic pack>" rules cost one search. Regexes are combined into one alternation,
+    which is searched again from wherever an alternative matched, without that alternative,
+    until none are left; so every regex is found if it matches anywhere, like with re.search().
+    Regexes that can't be combined (backreferences, named groups, global flags) are searched separately.
+    """
+    # literals are only grouped if their shared prefix is at least this long
+    min_prefix_length = 8
+
+    def __init__(self, keys):
+        keys = list(dict.fromkeys(keys))
+        literals = sorted(value for kind, value in keys if kind == "literal")
+        # shared prefix -> the literals that start with it; sorting puts the literals with a shared prefix next to each other
+        self.literal_groups: List[Tuple[str, List[str]]] = []
+        for literal in literals:
+            if self.literal_groups:
+                prefix, group = self.literal_groups[-1]
+                shared = os.path.commonprefix([prefix, literal])
+                if len(shared) >= self.min_prefix_length:
+                    self.literal_groups[-1] = (shared, group + [literal])
+                    continue
+            self.literal_groups.append((literal, [literal]))
+        regexes = [value for kind, value in keys if kind == "regex"]
+        self.combined = [regex for regex in regexes if self.combinable(regex)]
+        self.separate = [(regex, re.compile(regex, re.M)) for regex in regexes if regex not in self.combined]
+        # combined regexes that are left -> their alternation
+        self.alternations: Dict[Tuple[int, ...], re.Pattern] = {}
+
+    @staticmethod
+    def combinable(regex: str) -> bool:
+        try:
+            compiled = re.compile(regex, re.M)
+        except re.error:
+            return False
+        # group numbers and names would change (or clash) in the alternation, and global flags have to come first
+        return not compiled.groupindex and not re.search(r"\\[1-9]|\(\?P=|^\(\?[aiLmsux]+\)", regex)
+
+    def alternation(self, remaining: Tuple[int, ...]) -> re.Pattern:
+        if (pattern := self.alternations.get(remaining)) is None:
+            pattern = self.alternations[remaining] = re.compile(
+                "|".join(f"(?P<r{i}>{self.combined[i]})" for i in remaining), re.M)
+        return pattern
+
+    def scan(self, file: str) -> set:
+        hits = set()
+        for prefix, group in self.literal_groups:
+            if len(group) == 1:
+                if group[0] in file:
+                    hits.add(("literal", group[0]))
+                continue
+            remaining = list(group)
+            pos = file.find(prefix)
+            while pos != -1 and remaining:
+                for literal in [literal for literal in remaining if file.startswith(literal, pos)]:
+                    hits.add(("literal", literal))
+                    remaining.remove(literal)
+                pos = file.find(prefix, pos + 1)
+        remaining = tuple(range(len(self.combined)))
+        pos = 0
+        while remaining and (match := self.alternation(remaining).search(file, pos)):
+            i = int(match.lastgroup[1:])
+            hits.add(("regex", self.combined[i]))
+            remaining = tuple(j for j in remaining if j != i)
+            # another alternative could match at the same place
+            pos = match.start()
+        for regex, compiled in self.separate:
+            if compiled.search(file):
+                hits.add(("regex", regex))
+        return hits
+
+
+class LogHits:
+    """The keys of a LogPatternSet that a log contains; the log is only scanned once something asks."""
+    def __init__(self, patterns: LogPatternSet, file: str):
+        self.patterns = patterns
+        self.file = file
+        self.hits: Optional[set] = None
+        # how long the scan took, so that it's not counted towards the rule that started it
+        self.scan_time = 0.0
+
+    def __contains__(self, key) -> bool:
+        if self.hits is None:
+            start = time.perf_counter()
+            self.hits = self.patterns.scan(self.file)
+            self.scan_time = time.perf_counter() - start
+        return key in self.hits
+
+
+class LazyInfo(dict):
+    """
+    The info dict returned by Parser.parse().
+    Fields are only evaluated when they're first read, and then memoized,
+    so fields that nothing reads are never computed.
+    If timings is given, each field's own wall time (excluding the fields that it reads) is recorded.
+    """
+    def __init__(self, file, fields, timings: ParseTimings=None):
+        super().__init__()
+        self.file = file
+        self.fields = fields
+        self.evaluating = set()
+        self.timings = timings
+        # total wall time spent evaluating fields that weren't read by another field
+        self.field_time = 0.0
+    def __missing__(self, key):
+        func = self.fields[key]
+        if key in self.evaluating:
+            raise RuntimeError(f"Circular dependency while evaluating {key}")
+        self.evaluating.add(key)
+        try:
+            for dependency in getattr(func, "depends", ()):
+                self[dependency]
+            if self.timings is None:
+                result = func(self.file, self)
+            else:
+                outer_field_time, self.field_time = self.field_time, 0.0
+                start = time.perf_counter()
+                try:
+                    result = func(self.file, self)
+                finally:
+                    elapsed = time.perf_counter() - start
+                    # field_time now holds the time spent in the fields that this one read
+                    self.timings.record(f"field:{key}", elapsed - self.field_time)
+                    self.field_time = outer_field_time + elapsed
+        finally:
+            self.evaluating.discard(key)
+        self[key] = result if (result != None) else func.default
+        return self[key]
+    def evaluate(self, *fields):
+        """Evaluates the given fields (or every field, if none are given) and returns self."""
+        for field in (fields or self.fields):
+            self[field]
+        return self
+
 
 class Parser:
     """
@@ -34,18 +188,21 @@ class Parser:
         return bool(re.search(r"------- Loaded title -------", file))
     @name("init.game_crashed")
     @default(False)
+    @depends("init.loaded_title")
     def game_crashed(self, file, info):
         if info["init.loaded_title"]:
             return bool(re.search(r"Stack trace", file))
         return False
     @name("init.overwolf_issue")
     @default(False)
+    @depends("init.loaded_title")
     def overwolf_issue(self, file, info):
         if info["init.loaded_title"]:
             return bool(re.search(r"ow-graphics-vulkan\.dll", file))
         return False
     @name("init.piracy_check")
     @default(False)
+    @depends("init.loaded_title")
     def piracy_check(self, file, info):
         if info["init.loaded_title"]:
             return bool(re.search(r"\+0x001d9be4", file))
@@ -76,6 +233,7 @@ class Parser:
         return regex_group(updated, 1)
     @name("game.rpx_hash.base")
     @default("Unknown")
+    @depends("game.rpx_hash.updated")
     def rpx_hash_base(self, file, info):
         base = "N/A"
         if info["game.rpx_hash.updated"]:
@@ -135,6 +293,7 @@ class Parser:
         return []
     @name("settings.disabled_cpu_extensions")
     @default("")
+    @depends("settings.cpu_extensions")
     def disabled_cpu_extensions(self, file, info):
         used_extensions = re.search(r"CPU extensions that will actually be used by recompiler: (.*?)$", file, re.M)
         used_extensions = regex_group(used_extensions, 1, '').split(' ')
@@ -152,6 +311,7 @@ class Parser:
         return regex_group(re.search(r"------- Init (OpenGL|Vulkan) graphics backend -------", file), 1)
     @name("settings.vulkan_async")
     @default("Unknown")
+    @depends("settings.backend")
     def vulkan_async(self, file, info):
         if info["settings.backend"] == "Vulkan":
             result = re.search(r"Async compile: true", file)
@@ -159,6 +319,7 @@ class Parser:
         return "N/A"
     @name("settings.gx2drawdone")
     @default("Unknown")
+    @depends("settings.backend")
     def gx2drawdone(self, file, info):
         if info["settings.backend"] == "Vulkan":
             return "N/A"
@@ -181,6 +342,7 @@ class Parser:
         return result
     @name("settings.accurate_barriers")
     @default("Unknown")
+    @depends("emulator.cemu_version", "settings.backend")
     def accurate_barriers(self, file, info):
         if RulesetParser.version_check(info["emulator.cemu_version"], "1.26.2", "lt") \
         or (info["settings.backend"] == "OpenGL"):
@@ -194,6 +356,7 @@ class Parser:
                 return "Disabled" if result else "Enabled"
     @name("specs.gfx_api_version")
     @default("Unknown")
+    @depends("settings.backend")
     def gfx_api_version(self, file, info):
         if info["settings.backend"] == "OpenGL":
             # https://www.khronos.org/registry/OpenGL-Refpages/gl4/html/glGetString.xhtml#description
@@ -203,6 +366,8 @@ class Parser:
             return regex_group(re.search(r"Vulkan instance version: (.+?)$", file, re.M), 1)
         return None
     def __init__(self):
+        # set to a ParseTimings to record how long each field takes
+        self.timings = None
         self.embed = [
             self.loaded_title, self.game_crashed,
             self.overwolf_issue, self.piracy_check,
@@ -216,12 +381,12 @@ class Parser:
             self.thread_quantum, self.custom_timer_mode, self.accurate_barriers,
             self.gfx_api_version
         ]
-    def parse(self, file):
-        info = {}
-        for func in self.embed:
-            result = func(file, info)
-            info[func.name] = result if (result != None) else func.default
-        return info
+    def parse(self, file) -> LazyInfo:
+        """
+        Returns the log's info; fields are evaluated as they're read.
+        Use LazyInfo.evaluate() to evaluate all of them at once.
+        """
+        return LazyInfo(file, {func.name: func for func in self.embed}, self.timings)
 
 
 class ExtraParser(Parser):
@@ -231,37 +396,42 @@ class ExtraParser(Parser):
     """
     @name("specs.gpu_search_result")
     @default(GPUSearchResult())
+    @depends("specs.gpu")
     def gpu_search_result(self, file, info):
         if info["specs.gpu"] != "Unknown":
             return self.search_module.search(info["specs.gpu"])
     @name("specs.opengl.version")
     @default("Unknown")
+    @depends("specs.gpu_search_result")
     def opengl_version(self, file, info):
         if (opengl := info["specs.gpu_search_result"].opengl):
             return str(opengl.version)
     @name("specs.opengl.url")
     @default("")
+    @depends("specs.gpu_search_result")
     def opengl_url(self, file, info):
         if (opengl := info["specs.gpu_search_result"].opengl):
             return opengl.url or ""
     @name("specs.vulkan.version")
     @default("Unknown")
+    @depends("specs.gpu_search_result")
     def vulkan_version(self, file, info):
         if (vulkan := info["specs.gpu_search_result"].vulkan):
             return str(vulkan.version)
     @name("specs.vulkan.url")
     @default("")
+    @depends("specs.gpu_search_result")
     def vulkan_url(self, file, info):
         if (vulkan := info["specs.gpu_search_result"].vulkan):
             return vulkan.url or ""
     @name("game.wiki_page.url")
     @default("")
+    @depends("game.title_id")
     def wiki_page_url(self, file, info):
         try:
             if self.title_ids[info["game.title_id"]]["wiki_has_game_id_redirect"]:
                 return f"http://wiki.cemu.info/wiki/{self.title_ids[info['game.title_id']]['game_id']}"
             else:
-                # todo: use a cache of the cemu wiki instead of making a request on each parse
                 title = self.title_ids[info["game.title_id"]]["game_title"]
                 title = re.sub(r"[^\x00-\x7f]", r"", title)
                 title = title.replace(" ", "_")
@@ -271,15 +441,18 @@ class ExtraParser(Parser):
             return None
     @name("game.wiki_page.html")
     @default("")
+    @depends("game.title_id", "game.wiki_page.url")
     def wiki_page_html(self, file, info):
-        if info["game.wiki_page.url"]:
-            req = requests.get(info["game.wiki_page.url"])
-            if req.status_code == 200:
-                return req.text
+        # the compatibility index already has everything that the page would be fetched for
+        if info["game.wiki_page.url"] and not self.compat_index.get(info["game.title_id"]):
+            return self.wiki_cache.get(info["game.title_id"], info["game.wiki_page.url"])
         return None
     @name("game.compat.rating")
     @default("Unknown")
+    @depends("game.title_id")
     def compat_rating(self, file, info):
+        if (entry := self.compat_index.get(info["game.title_id"])):
+            return entry["rating"]
         compat = regex_match(
             re.findall(r"<tr style=\"vertical-align:middle;\">.*?</tr>", info["game.wiki_page.html"], re.M|re.S),
             -1, ""
@@ -290,7 +463,10 @@ class ExtraParser(Parser):
         )
     @name("game.compat.version")
     @default("Unknown")
+    @depends("game.title_id")
     def compat_version(self, file, info):
+        if (entry := self.compat_index.get(info["game.title_id"])):
+            return entry["version"]
         compat = regex_match(
             re.findall(r"<tr style=\"vertical-align:middle;\">.*?</tr>", info["game.wiki_page.html"], re.M|re.S),
             -1, ""
@@ -299,12 +475,20 @@ class ExtraParser(Parser):
             re.search(r"<a href=\"(?:/wiki/|/index\.php\?title=)Release.*? title=\".*?\">(.*?)</a>", compat),
             1
         )
-    def __init__(self, title_ids, search_module=None):
+    def __init__(self, title_ids, search_module=None, wiki_cache=None, compat_index=None):
         super().__init__()
         if search_module is None:
             self.search_module = GPUInfoSearch()
         else:
             self.search_module = search_module
+        if wiki_cache is None:
+            self.wiki_cache = WikiPageCache()
+        else:
+            self.wiki_cache = wiki_cache
+        if compat_index is None:
+            self.compat_index = CompatIndex()
+        else:
+            self.compat_index = compat_index
         self.title_ids = title_ids
         self.embed += [
             self.gpu_search_result, self.opengl_version, self.opengl_url,
@@ -319,9 +503,31 @@ class RulesetParser:
     A class that takes log info parsed by {Parser} and a dictionary of rulesets,
     and runs those rulesets on the data to determine potential problems.
     To use this class, create an instance of it and run RulesetParser.parse().
+    The rulesets are compiled once when the class is created;
+    each rule becomes a (match_type, message, tests) tuple,
+    where every test is a function that takes (log_file, info, hits) and returns a bool.
+    The strings and regexes that the "any" ruleset and each game's ruleset look for in the log
+    are collected into a LogPatternSet, so a log is scanned for all of them at once and the tests
+    only look their pattern up in the hits; with hits=None, tests search the log themselves.
     """
     def __init__(self, rulesets):
         self.rulesets = rulesets
+        # set to a ParseTimings to record how long each rule takes
+        self.timings = None
+        self.programs = {}
+        self.log_patterns = {}
+        for title_id, ruleset in rulesets.items():
+            if type(ruleset) != str:
+                self.programs[title_id] = self.compile_ruleset(ruleset)
+                self.log_patterns[title_id] = LogPatternSet(
+                    self.log_pattern_keys(rulesets.get("any", [])) + self.log_pattern_keys(ruleset))
+        # to avoid duplicate rulesets,
+        # one title ID (usually USA) holds the game's ruleset,
+        # and the other regions simply redirect to it
+        for title_id, ruleset in rulesets.items():
+            if type(ruleset) == str and ruleset in self.programs:
+                self.programs[title_id] = self.programs[ruleset]
+                self.log_patterns[title_id] = self.log_patterns[ruleset]
     # determines if ver1 <=> ver2
     @staticmethod
     def version_check(ver1, ver2, operation):
@@ -335,51 +541,154 @@ class RulesetParser:
             return ver1 > ver2
         else:
             raise ValueError("Invalid operation; must be lt, eq, ne, or gt")
+    @staticmethod
+    def compile_check(rule_type, value):
+        """Returns a function that takes a property and checks it against value."""
+        if rule_type == "str_eq":
+            return lambda prop: prop == value
+        elif rule_type == "str_ne":
+            return lambda prop: prop != value
+        elif rule_type == "str_contains":
+            return lambda prop: value in prop
+        elif rule_type == "str_not_contains":
+            return lambda prop: value not in prop
+        elif rule_type in ("int_lt", "int_eq", "int_gt"):
+            threshold = float(value)
+            if rule_type == "int_lt":
+                return lambda prop: float(prop) < threshold
+            elif rule_type == "int_eq":
+                return lambda prop: float(prop) == threshold
+            return lambda prop: float(prop) > threshold
+        elif rule_type == "rgx_matches":
+            regex = re.compile(value, re.M)
+            return lambda prop: bool(regex.search(prop))
+        elif rule_type in ("ver_lt", "ver_eq", "ver_ne", "ver_gt"):
+            operation = rule_type[4:]
+            return lambda prop: RulesetParser.version_check(prop, value, operation)
+        return lambda prop: False
+    @staticmethod
+    def log_pattern_key(test) -> Optional[tuple]:
+        """The LogPatternSet key that a test looks for in the log, if it's one that can be looked up in the hits."""
+        if test["property"] != "log":
+            return None
+        if test["type"] in ("str_contains", "str_not_contains"):
+            return ("literal", test["value"])
+        if test["type"] == "rgx_matches":
+            return ("regex", test["value"])
+        return None
+    @staticmethod
+    def log_pattern_keys(ruleset: list) -> list:
+        keys = [RulesetParser.log_pattern_key(test) for rule in ruleset for test in rule["rules"]]
+        return [key for key in keys if key is not None]
+    @staticmethod
+    def compile_test(test):
+        check = RulesetParser.compile_check(test["type"], test["value"])
+        if (key := RulesetParser.log_pattern_key(test)) is not None:
+            found = test["type"] != "str_not_contains"
+            return lambda log_file, info, hits: check(log_file) if hits is None else (key in hits) == found
+        if test["property"] == "log":
+            return lambda log_file, info, hits: check(log_file)
+        prop = test["property"]
+        return lambda log_file, info, hits: check(info[prop])
+    @staticmethod
+    def compile_ruleset(ruleset: list) -> list:
+        return [
+            (rule["match"], rule["message"], [RulesetParser.compile_test(test) for test in rule["rules"]])
+            for rule in ruleset
+        ]
     def parse(self, log_file: str, info: dict) -> list:
         relevant_info = []
-        relevant_info.extend(self.parse_ruleset(log_file, info, self.rulesets["any"]))
-        try:
-            ruleset = self.rulesets[info["game.title_id"]]
-            # to avoid duplicate rulesets,
-            # one title ID (usually USA) holds the game's ruleset,
-            # and the other regions simply redirect to it
-            if type(ruleset) == str:
-                ruleset = self.rulesets[ruleset]
-            relevant_info.extend(self.parse_ruleset(log_file, info, ruleset))
-        except KeyError:
-            pass
+        program = self.programs.get(info["game.title_id"])
+        patterns = self.log_patterns["any"] if program is None else self.log_patterns[info["game.title_id"]]
+        # shared by both rulesets, so the log is scanned at most once
+        hits = LogHits(patterns, log_file)
+        relevant_info.extend(self.run_ruleset(log_file, info, self.programs["any"], "any", hits))
+        if program is not None:
+            relevant_info.extend(self.run_ruleset(log_file, info, program, info["game.title_id"], hits))
+        if self.timings is not None and hits.hits is not None:
+            self.timings.record("log_scan", hits.scan_time)
         return relevant_info
     def parse_ruleset(self, log_file: str, info: dict, ruleset: list) -> list:
+        return self.run_ruleset(log_file, info, self.compile_ruleset(ruleset))
+    def run_ruleset(self, log_file: str, info: dict, program: list, name: str="custom", hits: LogHits=None) -> list:
         messages = []
-        for rule in ruleset:
-            match_type = rule["match"]
-            message = rule["message"]
+        for index, (match_type, message, tests) in enumerate(program):
+            if self.timings is not None:
+                # fields that the rule reads for the first time are recorded under their own name,
+                # and so is the log scan, if the rule is the one that started it
+                field_time = getattr(info, "field_time", 0.0)
+                scan_time = getattr(hits, "scan_time", 0.0)
+                start = time.perf_counter()
             test_result = None
-            for test in rule["rules"]:
-                test_result = True
-                if test["property"] == "log":
-                    prop = log_file
-                else:
-                    prop = info[test["property"]]
-                rule_type = test["type"]
-                value = test["value"]
-                test_result = (\
-                    (rule_type == "str_eq" and prop == value) or \
-                    (rule_type == "str_ne" and prop != value) or \
-                    (rule_type == "str_contains" and value in prop) or \
-                    (rule_type == "str_not_contains" and value not in prop) or \
-                    (rule_type == "int_lt" and float(prop) < value) or \
-                    (rule_type == "int_eq" and float(prop) == value) or \
-                    (rule_type == "int_gt" and float(prop) > value) or \
-                    (rule_type == "rgx_matches" and re.search(value, prop, re.M)) or \
-                    (rule_type == "ver_lt" and self.version_check(prop, value, "lt")) or \
-                    (rule_type == "ver_eq" and self.version_check(prop, value, "eq")) or \
-                    (rule_type == "ver_ne" and self.version_check(prop, value, "ne")) or \
-                    (rule_type == "ver_gt" and self.version_check(prop, value, "gt"))
-                )
+            for test in tests:
+                test_result = test(log_file, info, hits)
                 if ((not test_result) and (match_type == "all")) \
                 or ((    test_result) and (match_type == "any")):
                     break
+            if self.timings is not None:
+                elapsed = time.perf_counter() - start - (getattr(info, "field_time", 0.0) - field_time) \
+                          - (getattr(hits, "scan_time", 0.0) - scan_time)
+                self.timings.record(f"rule:{name}[{index}] {message[:40]}", elapsed)
             if test_result:
                 messages.append(message.format(info))
         return messages
+
+
+def parse_log_file(log: bytes, parser: Parser, ruleset_parser: RulesetParser, fields=()) -> tuple:
+    """
+    Decodes a log file and runs it through both parsers.
+    Returns (info, relevant_info); relevant_info is None if no title was loaded.
+    info is a plain dict of the fields that were evaluated, i.e. the ones that the rulesets read,
+    the given fields (which are only evaluated if a title was loaded), and the init.* fields.
+    This is what gets run on the parse executor, so it must not touch anything Discord-related.
+    """
+    log = log.replace(b'\r', b'')
+    try:
+        log = log.decode('utf-8')
+    except UnicodeDecodeError:
+        # brazilian portugese was causing problems
+        log = log.decode('latin-1')
+    start = time.perf_counter()
+    info = parser.parse(log)
+    info.evaluate("init.loaded_title", "init.game_crashed", "init.piracy_check", "init.overwolf_issue")
+    if not info["init.loaded_title"]:
+        relevant_info = None
+    else:
+        relevant_info = ruleset_parser.parse(log, info)
+        info.evaluate(*fields)
+    if parser.timings is not None:
+        parser.timings.record("total", time.perf_counter() - start)
+    return dict(info), relevant_info
+
+
+# parsers owned by a parse worker process, created once by init_worker()
+worker_parser = None
+worker_ruleset_parser = None
+
+def init_worker(title_ids, rulesets, gpu_snapshot_path, wiki_cache_ttl=6*60*60, timings=False):
+    """
+    Process pool initializer; builds the worker's parsers from the parent's reference data.
+    The GPU databases are loaded from the parent's snapshot, so that workers don't have to
+    download them themselves (or have them pickled over).
+    If timings is set, worker_parse_log_file() also returns the timing samples of each parse.
+    """
+    global worker_parser, worker_ruleset_parser
+    # the parent process downloads missing databases, and restarts the workers when it's done
+    search_module = GPUInfoSearch(init_cache=False, snapshot_path=gpu_snapshot_path, backfill=False)
+    # start from the parent's memo, but leave saving it to the parent,
+    # so that the processes don't keep replacing each other's entries
+    search_module.memo_path = None
+    worker_parser = ExtraParser(title_ids, search_module, wiki_cache=WikiPageCache(ttl=wiki_cache_ttl))
+    worker_ruleset_parser = RulesetParser(rulesets)
+    if timings:
+        worker_parser.timings = worker_ruleset_parser.timings = ParseTimings(window=1)
+        worker_parser.timings.keep_unsent = True
+
+def worker_parse_log_file(log: bytes, fields=()) -> tuple:
+    """Returns (info, relevant_info, timing samples); the samples are empty if timings are off."""
+    info, relevant_info = parse_log_file(log, worker_parser, worker_ruleset_parser, fields)
+    samples = worker_parser.timings.drain() if worker_parser.timings else []
+    return info, relevant_info, samples
+
+def worker_ready() -> bool:
+    return worker_parser is not None
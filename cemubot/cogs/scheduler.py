@@ -0,0 +1,166 @@
+from collections import OrderedDict, deque
+import asyncio
+import discord
+import traceback
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class ParseJob:
+    """A log waiting to be parsed, along with every reply that's waiting on it."""
+    digest: bytes
+    log_data: bytes
+    channel_id: int
+    user_id: int
+    # (log_url, reply_msg) for every time this log was posted while it was queued
+    replies: List[Tuple[str, discord.Message]]
+    position: Optional[int] = None
+    started: bool = False
+
+    def __init__(self, digest: bytes, log_data: bytes, channel_id: int, user_id: int):
+        self.digest = digest
+        self.log_data = log_data
+        self.channel_id = channel_id
+        self.user_id = user_id
+        self.replies = []
+
+
+class ParseScheduler:
+    """
+    Bounded queue that sits between on_message and parse_log.
+    Jobs are handed out round-robin between channels, and between users within a channel,
+    so that one user posting a pile of logs can't starve everyone else.
+    Identical logs that are already queued share a single job.
+    Queue positions are shown by editing the replies, at most once every position_update_interval seconds.
+    """
+    position_update_interval = 5.0
+
+    def __init__(self, handler: Callable[[str, bytes, discord.Message], Awaitable[None]],
+                 workers: int=4, max_size: int=50, max_per_user: int=3):
+        self.handler = handler
+        self.worker_count = workers
+        self.max_size = max_size
+        self.max_per_user = max_per_user
+        # channel ID -> user ID -> queued jobs
+        self.queues: "OrderedDict[int, OrderedDict[int, deque]]" = OrderedDict()
+        self.pending: Dict[bytes, ParseJob] = {}
+        self.workers: List[asyncio.Task] = []
+        self.busy = 0
+        self.condition: Optional[asyncio.Condition] = None
+        self.positions_changed: Optional[asyncio.Event] = None
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def start(self) -> None:
+        self.condition = asyncio.Condition()
+        self.positions_changed = asyncio.Event()
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(self.worker_count)]
+        self.workers.append(asyncio.create_task(self.position_updater()))
+
+    def stop(self) -> None:
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+
+    def user_jobs(self, user_id: int) -> int:
+        # pending includes the jobs that are being parsed
+        return sum(1 for job in self.pending.values() if job.user_id == user_id)
+
+    async def submit(self, digest: bytes, log_url: str, log_data: bytes,
+                     message: discord.Message, reply_msg: discord.Message) -> bool:
+        """
+        Queues a log for parsing; reply_msg is edited with the result.
+        Returns False (after editing reply_msg) if the log was rejected because the queue is full.
+        """
+        if (job := self.pending.get(digest)) is not None:
+            job.replies.append((log_url, reply_msg))
+            return True
+        if len(self.pending) >= self.max_size:
+            await reply_msg.edit(content="Error: Too many logs are waiting to be parsed right now; please try again in a minute.")
+            return False
+        if self.user_jobs(message.author.id) >= self.max_per_user:
+            await reply_msg.edit(content="Error: You already have too many logs waiting to be parsed; please wait for them to finish.")
+            return False
+        job = ParseJob(digest, log_data, message.channel.id, message.author.id)
+        job.replies.append((log_url, reply_msg))
+        self.pending[digest] = job
+        self.queues.setdefault(job.channel_id, OrderedDict()).setdefault(job.user_id, deque()).append(job)
+        async with self.condition:
+            self.condition.notify()
+        self.positions_changed.set()
+        return True
+
+    @staticmethod
+    def pop_next(queues: "OrderedDict[int, OrderedDict[int, deque]]") -> ParseJob:
+        """Removes and returns the next job in round-robin order; queues must not be empty."""
+        channel_id, users = next(iter(queues.items()))
+        queues.move_to_end(channel_id)
+        user_id, jobs = next(iter(users.items()))
+        users.move_to_end(user_id)
+        job = jobs.popleft()
+        if not jobs:
+            del users[user_id]
+        if not users:
+            del queues[channel_id]
+        return job
+
+    def order(self) -> List[ParseJob]:
+        """Every queued job, in the order that they'll be taken."""
+        queues = OrderedDict(
+            (channel_id, OrderedDict((user_id, deque(jobs)) for user_id, jobs in users.items()))
+            for channel_id, users in self.queues.items()
+        )
+        result = []
+        while queues:
+            result.append(self.pop_next(queues))
+        return result
+
+    async def update_positions(self) -> None:
+        """Edits the reply of every queued job whose position in the queue changed."""
+        # jobs that an idle worker is about to take don't need a position
+        idle = self.worker_count - self.busy
+        changed = []
+        for position, job in enumerate(self.order()[idle:], 1):
+            if job.position != position:
+                job.position = position
+                changed.append(job)
+        # one at a time, so that the edits don't use up the channels' rate limits all at once
+        for job in changed:
+            for log_url, reply_msg in list(job.replies):
+                # a worker could have taken the job (and started editing its replies) in the meantime
+                if job.started:
+                    break
+                try:
+                    await reply_msg.edit(content=f"Log detected, waiting to be parsed (position {job.position} in queue)...")
+                except discord.HTTPException:
+                    pass
+
+    async def position_updater(self) -> None:
+        """Coalesces the position updates of every submit and dequeue in each interval into one."""
+        while True:
+            await self.positions_changed.wait()
+            self.positions_changed.clear()
+            try:
+                await self.update_positions()
+            except Exception:
+                traceback.print_exc()
+            await asyncio.sleep(self.position_update_interval)
+
+    async def worker(self) -> None:
+        while True:
+            async with self.condition:
+                await self.condition.wait_for(lambda: bool(self.queues))
+                job = self.pop_next(self.queues)
+                job.started = True
+                self.busy += 1
+            self.positions_changed.set()
+            try:
+                for log_url, reply_msg in job.replies:
+                    if job.position is not None:
+                        await reply_msg.edit(content="Log detected, parsing...")
+                    await self.handler(log_url, job.log_data, reply_msg)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self.busy -= 1
+                del self.pending[job.digest]
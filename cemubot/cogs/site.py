@@ -6,7 +6,7 @@ import re
 from datetime import datetime, date, timedelta, timezone
 import aiohttp
 
-from cogs import config
+from cogs import config, metrics
 
 class Site(commands.Cog):
     bot : discord.Client = None
@@ -53,7 +53,7 @@ class Site(commands.Cog):
 
     @tasks.loop(minutes=2.0)
     async def getLatestVersion(self):
-        async with aiohttp.ClientSession() as session:
+        async with aiohttp.ClientSession(trace_configs=[metrics.trace_config()]) as session:
             async with session.get("http://cemu.info/api/cemu_version3.php") as res:
                 if res.status == 200:
                     try:
@@ -66,7 +66,7 @@ class Site(commands.Cog):
 
     @tasks.loop(minutes=10.0)
     async def getAllVersions(self):
-        async with aiohttp.ClientSession() as session:
+        async with aiohttp.ClientSession(trace_configs=[metrics.trace_config()]) as session:
             async with session.get("http://cemu.info/changelog.html") as res:
                 if res.status == 200:
                     try:
@@ -0,0 +1,85 @@
+from collections import deque
+import threading
+from typing import Dict, List, Tuple
+
+
+class ParseTimings:
+    """
+    Rolling wall time samples for parser fields and ruleset rules.
+    Keys look like "field:<name>", "rule:<title ID or any>[<index>] <message>" and "total".
+    Only the last `window` samples of each key are kept, so the histograms follow recent logs;
+    the counts and totals cover everything since the bot started.
+    """
+    # upper bounds of the histogram buckets, in seconds
+    buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+    def __init__(self, window: int=500):
+        self.window = window
+        self.samples: Dict[str, deque] = {}
+        self.counts: Dict[str, int] = {}
+        self.totals: Dict[str, float] = {}
+        # samples recorded since the last drain(); only used by parse worker processes
+        self.unsent: List[Tuple[str, float]] = []
+        self.keep_unsent = False
+        self.lock = threading.Lock()
+
+    def record(self, key: str, seconds: float) -> None:
+        with self.lock:
+            if key not in self.samples:
+                self.samples[key] = deque(maxlen=self.window)
+                self.counts[key] = 0
+                self.totals[key] = 0.0
+            self.samples[key].append(seconds)
+            self.counts[key] += 1
+            self.totals[key] += seconds
+            if self.keep_unsent:
+                self.unsent.append((key, seconds))
+
+    def record_many(self, samples: List[Tuple[str, float]]) -> None:
+        for key, seconds in samples:
+            self.record(key, seconds)
+
+    def drain(self) -> List[Tuple[str, float]]:
+        """Returns and forgets the samples recorded since the last drain()."""
+        with self.lock:
+            samples, self.unsent = self.unsent, []
+        return samples
+
+    def clear(self) -> None:
+        with self.lock:
+            self.samples.clear()
+            self.counts.clear()
+            self.totals.clear()
+            self.unsent = []
+
+    @classmethod
+    def histogram(cls, samples: list) -> Dict[str, int]:
+        result = {f"<={bound}s": 0 for bound in cls.buckets}
+        result[f">{cls.buckets[-1]}s"] = 0
+        for seconds in samples:
+            for bound in cls.buckets:
+                if seconds <= bound:
+                    result[f"<={bound}s"] += 1
+                    break
+            else:
+                result[f">{cls.buckets[-1]}s"] += 1
+        return result
+
+    def summary(self) -> Dict[str, dict]:
+        """Structured dump of every key's stats, suitable for json.dump()."""
+        with self.lock:
+            snapshot = {key: (sorted(samples), self.counts[key], self.totals[key])
+                        for key, samples in self.samples.items()}
+        result = {}
+        for key, (samples, count, total) in snapshot.items():
+            result[key] = {
+                "count": count,
+                "total": total,
+                "window": len(samples),
+                "mean": sum(samples) / len(samples),
+                "p50": samples[len(samples) // 2],
+                "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+                "max": samples[-1],
+                "histogram": self.histogram(samples)
+            }
+        return result
@@ -0,0 +1,219 @@
+# compact store of the title ID database (misc/title_ids.json), for the bot and the parse workers
+from .cache import atomic_write_json, replace_file
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import traceback
+from typing import Dict, Iterator, Optional, Tuple
+
+
+class TitleEntry:
+    """
+    One title's fields, read like the dicts in title_ids.json.
+    The hot fields are kept in memory; the rest are read from the database when they're asked for.
+    """
+    __slots__ = ("store", "title_id", "hot")
+
+    def __init__(self, store: "TitleStore", title_id: str, hot: tuple):
+        self.store = store
+        self.title_id = title_id
+        self.hot = hot
+
+    def __getitem__(self, key: str):
+        if key in TitleStore.hot_positions:
+            return self.hot[TitleStore.hot_positions[key]]
+        if key in TitleStore.cold_fields:
+            return self.store.cold_field(self.title_id, key)
+        raise KeyError(key)
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self) -> Tuple[str, ...]:
+        return TitleStore.fields
+
+    def items(self) -> list:
+        return [(key, self[key]) for key in TitleStore.fields]
+
+    def __contains__(self, key) -> bool:
+        return key in TitleStore.fields
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(TitleStore.fields)
+
+    def __len__(self) -> int:
+        return len(TitleStore.fields)
+
+
+class TitleStore:
+    """
+    Read-only mapping of title IDs to TitleEntrys, backed by an SQLite copy of title_ids.json.
+    The copy is (re)built whenever title_ids.json changes, so startup doesn't have to parse the JSON,
+    and only the fields that the parser and cogs read all the time are loaded into memory,
+    the first time that any title is looked up.
+    Pickling it only pickles the paths, so parse worker processes load their own copy lazily.
+    """
+    # the fields that are kept in memory, and the ones that are only read from the database
+    hot_fields = ("game_title", "game_id", "region", "wiki_has_game_id_redirect")
+    cold_fields = ("product_code", "company_code", "notes", "versions", "cdn_available")
+    fields = hot_fields + cold_fields
+    hot_positions = {field: i for i, field in enumerate(hot_fields)}
+    # bump this whenever the database's layout changes, so that old copies are rebuilt
+    database_format = 1
+
+    def __init__(self, json_path: str="misc/title_ids.json", database_path: Optional[str]="misc/cache/title_ids.sqlite3"):
+        self.json_path = json_path
+        self.database_path = database_path
+        self.lock = threading.Lock()
+        self.connection: Optional[sqlite3.Connection] = None
+        # title ID -> hot fields, in hot_fields order; None until the first lookup
+        self.hot: Optional[Dict[str, tuple]] = None
+
+    def __getstate__(self):
+        return {"json_path": self.json_path, "database_path": self.database_path}
+
+    def __setstate__(self, state):
+        self.__init__(state["json_path"], state["database_path"])
+
+    def source_version(self) -> Optional[list]:
+        """What the database has to have been built from to be up to date with title_ids.json."""
+        try:
+            stat = os.stat(self.json_path)
+        except OSError:
+            return None
+        return [self.database_format, stat.st_mtime_ns, stat.st_size]
+
+    @classmethod
+    def write_database(cls, connection: sqlite3.Connection, title_ids: dict, version: Optional[list]) -> None:
+        connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        # rowids keep the titles in the same order as title_ids.json
+        connection.execute(f"CREATE TABLE titles (title_id TEXT UNIQUE NOT NULL, {', '.join(cls.fields)})")
+        connection.executemany(
+            f"INSERT INTO titles VALUES (?, {', '.join('?' * len(cls.fields))})",
+            ((title_id, *(info.get(field) for field in cls.fields)) for title_id, info in title_ids.items()))
+        connection.execute("INSERT INTO meta VALUES ('source', ?)", (json.dumps(version),))
+        connection.commit()
+
+    def build_database(self, title_ids: Optional[dict]=None) -> sqlite3.Connection:
+        """
+        Copies title_ids.json (or title_ids, if it's what was just written to title_ids.json) into the database,
+        replacing it so that other processes never see half of it.
+        """
+        version = self.source_version()
+        if title_ids is None:
+            with open(self.json_path, "r", encoding="utf-8") as f:
+                title_ids = json.load(f)
+        if self.database_path:
+            try:
+                directory = os.path.dirname(self.database_path) or "."
+                os.makedirs(directory, exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+                os.close(fd)
+                try:
+                    connection = sqlite3.connect(temp_path)
+                    try:
+                        self.write_database(connection, title_ids, version)
+                    finally:
+                        connection.close()
+                    replace_file(temp_path, self.database_path)
+                except BaseException:
+                    os.unlink(temp_path)
+                    raise
+                return sqlite3.connect(self.database_path, check_same_thread=False)
+            except (OSError, sqlite3.Error):
+                print("Couldn't write the title ID database; keeping it in memory instead")
+                traceback.print_exc()
+        connection = sqlite3.connect(":memory:", check_same_thread=False)
+        self.write_database(connection, title_ids, version)
+        return connection
+
+    def open(self) -> sqlite3.Connection:
+        """Opens the database, rebuilding it first if it's missing or older than title_ids.json."""
+        version = self.source_version()
+        if self.database_path and os.path.exists(self.database_path):
+            connection = sqlite3.connect(self.database_path, check_same_thread=False)
+            try:
+                row = connection.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+                # without title_ids.json, whatever the database has is the best there is
+                if row and (version is None or json.loads(row[0]) == version):
+                    return connection
+            except sqlite3.Error:
+                pass
+            connection.close()
+        return self.build_database()
+
+    @classmethod
+    def read_hot(cls, connection: sqlite3.Connection) -> Dict[str, tuple]:
+        rows = connection.execute(f"SELECT title_id, {', '.join(cls.hot_fields)} FROM titles ORDER BY rowid").fetchall()
+        # there are only a handful of different regions, so share their strings
+        return {
+            title_id: (game_title, game_id, sys.intern(region or ""), bool(wiki_redirect))
+            for title_id, game_title, game_id, region, wiki_redirect in rows
+        }
+
+    def titles(self) -> Dict[str, tuple]:
+        # read self.hot once, since an update() on another thread could swap it
+        hot = self.hot
+        return hot if hot is not None else self.load()
+
+    def load(self) -> Dict[str, tuple]:
+        with self.lock:
+            if self.hot is None:
+                if self.connection is None:
+                    self.connection = self.open()
+                self.hot = self.read_hot(self.connection)
+            return self.hot
+
+    def update(self, title_ids: dict) -> None:
+        """
+        Writes title_ids to title_ids.json and swaps them in. Everything is built before the swap,
+        so lookups (from any thread) keep seeing the old titles until they see all of the new ones.
+        This blocks for a while, so run it in an executor.
+        """
+        atomic_write_json(self.json_path, title_ids, indent=4)
+        connection = self.build_database(title_ids)
+        hot = self.read_hot(connection)
+        with self.lock:
+            old_connection, self.connection, self.hot = self.connection, connection, hot
+        if old_connection is not None:
+            old_connection.close()
+
+    def cold_field(self, title_id: str, field: str):
+        with self.lock:
+            if self.connection is None:
+                self.connection = self.open()
+            row = self.connection.execute(f"SELECT {field} FROM titles WHERE title_id = ?", (title_id,)).fetchone()
+        if row is None:
+            raise KeyError(title_id)
+        return row[0]
+
+    def __getitem__(self, title_id: str) -> TitleEntry:
+        return TitleEntry(self, title_id, self.titles()[title_id])
+
+    def get(self, title_id: str, default=None):
+        try:
+            return self[title_id]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self.titles().keys()
+
+    def items(self) -> Iterator[Tuple[str, TitleEntry]]:
+        for title_id, hot in list(self.titles().items()):
+            yield title_id, TitleEntry(self, title_id, hot)
+
+    def __contains__(self, title_id) -> bool:
+        return title_id in self.titles()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.titles())
@@ -1,9 +1,14 @@
+import aiohttp
+import asyncio
 from discord.ext import commands
 import discord
+import io
 import json
 import re
-import requests
 import traceback
+from typing import Optional
+
+from cogs.cache import atomic_write_json
 
 
 def regex_group(search, num, default=None):
@@ -20,6 +25,14 @@ def regex_match(findall, num, default=None):
 
 
 class Utility(commands.Cog):
+	wiiubrew_api_url = "http://wiiubrew.org/w/api.php"
+	wiiubrew_page = "Title_database"
+	wiki_api_url = "http://wiki.cemu.info/api.php"
+	# where the wiki's redirects are split up to fetch them concurrently
+	redirect_range_bounds = ["C", "F", "K", "N", "R", "T"]
+	# what update_title_ids needs to remember between updates, e.g. wiiubrew's last revision
+	title_ids_state_path = "misc/cache/title_ids_state.json"
+
 	def __init__(self, bot):
 		self.bot = bot
 
@@ -28,47 +41,99 @@ class Utility(commands.Cog):
 	async def update_db(self, ctx):
 		reply_msg = await ctx.channel.send("Updating title ID database...")
 		try:
-			self.update_title_ids()
-			await reply_msg.edit(content="Successfully updated title ID database.")
+			if await self.update_title_ids():
+				await reply_msg.edit(content="Successfully updated title ID database.")
+			else:
+				await reply_msg.edit(content="The title ID database is already up to date.")
 		except Exception as e:
 			await reply_msg.edit(content=f"Error: Couldn't update title ID database; threw {type(e).__name__} exception")
 			traceback.print_exc()
 
-	def update_title_ids(self):
-		session = requests.Session()
-
-		def validate_req(req):
-			if req.status_code != 200:
-				raise requests.HTTPError(f"Error: request to {req.url} returned {req.status_code}")
-
-		# continue_key is the API argument that allows you to continue from a certain point in the search
-		# `&list=categorymembers` has `cmcontinue`, `&generator=allredirects` has `garcontinue`, etc.
-		# just read the mediawiki API docs for whatever endpoint you're using and look for an argument that says:
-		# "When more results are available, use this to continue."
-		def get_all_results(req, continue_key, api_url):
-			req_json = json.loads(req.text)
-			try:
-				req_json["continue"][continue_key]
-			except KeyError:
-				return req_json
-			while req_json["continue"][continue_key]:
-				new_req = session.get(f"{api_url}&{continue_key}={req_json['continue'][continue_key]}")
-				validate_req(new_req)
-				new_req = json.loads(new_req.text)
-				try:
-					req_json["query"][list(req_json["query"].keys())[0]].extend(new_req["query"][list(new_req["query"].keys())[0]])
-				except AttributeError:
-					req_json["query"][list(req_json["query"].keys())[0]].update(new_req["query"][list(new_req["query"].keys())[0]])
-				try:
-					req_json["continue"] = new_req["continue"]
-				except KeyError:
-					break
-			return req_json
-
-		game_info = session.get("http://wiiubrew.org/w/api.php?action=parse&format=json&page=Title_database&section=5&prop=wikitext")
-		validate_req(game_info)
-		game_info = json.loads(game_info.text)
-		game_info = game_info["parse"]["wikitext"]["*"]
+	@commands.command(help="Shows the slowest parser fields and rules. Pass \"dump\" to get every timing as JSON instead. Only the bot's owner can run this command.")
+	@commands.is_owner()
+	async def parse_timings(self, ctx, mode: str="top", count: int=15):
+		if self.bot.parse_timings is None:
+			await ctx.channel.send("Parse timings are disabled; set \"parse_timings\" to true in the config to enable them.")
+			return
+		summary = self.bot.parse_timings.summary()
+		if mode == "dump":
+			dump = io.BytesIO(json.dumps(summary, indent=4, sort_keys=True).encode("utf-8"))
+			await ctx.channel.send(file=discord.File(dump, filename="parse_timings.json"))
+			return
+		if not summary:
+			await ctx.channel.send("No logs have been parsed yet.")
+			return
+		lines = [f"{'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'count':>6}  key"]
+		for key, stats in sorted(summary.items(), key=lambda item: item[1]["p95"], reverse=True)[:count]:
+			lines.append(f"{stats['p50'] * 1000:9.2f} {stats['p95'] * 1000:9.2f} {stats['max'] * 1000:9.2f} {stats['count']:6}  {key}")
+		table = "\n".join(lines)
+		# keep the message under Discord's 2000 character limit
+		await ctx.channel.send(f"```\n{table[:1990]}\n```")
+
+	async def update_title_ids(self) -> bool:
+		"""
+		Downloads the title ID database and swaps it in for the whole bot; returns False if nothing changed.
+		Wiiubrew's title list is only downloaded when its page has a new revision,
+		and the wiki's redirects are fetched in several ranges at once.
+		"""
+		loop = asyncio.get_running_loop()
+		session = self.bot.get_http_session()
+		state = await loop.run_in_executor(None, self.load_json, self.title_ids_state_path)
+		store = self.bot.title_ids
+		current = await loop.run_in_executor(None, self.load_json, store.json_path)
+
+		revid, wiki_game_ids = await asyncio.gather(
+			self.get_wiiubrew_revid(session), self.get_wiki_game_ids(session))
+		if current and revid is not None and revid == state.get("wiiubrew_revid"):
+			game_info = {title_id: dict(info) for title_id, info in current.items()}
+		else:
+			game_info = await loop.run_in_executor(None, self.parse_title_database, await self.get_wiiubrew_wikitext(session))
+
+		for info in game_info.values():
+			info["wiki_has_game_id_redirect"] = (info["game_id"] in wiki_game_ids)
+
+		changed = game_info != current
+		if changed:
+			await loop.run_in_executor(None, store.update, game_info)
+			self.bot.on_title_ids_swapped()
+		state["wiiubrew_revid"] = revid
+		await loop.run_in_executor(None, atomic_write_json, self.title_ids_state_path, state)
+		return changed
+
+	@staticmethod
+	def load_json(path: str) -> dict:
+		try:
+			with open(path, "r", encoding="utf-8") as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return {}
+
+	@staticmethod
+	async def get_json(session: aiohttp.ClientSession, url: str, params: dict) -> dict:
+		async with session.get(url, params=params) as req:
+			if req.status != 200:
+				raise aiohttp.ClientResponseError(req.request_info, req.history, status=req.status,
+					message=f"Error: request to {req.url} returned {req.status}")
+			return await req.json(content_type=None)
+
+	async def get_wiiubrew_revid(self, session: aiohttp.ClientSession) -> Optional[int]:
+		"""The current revision of wiiubrew's title database page; a cheap way to tell whether it changed."""
+		req_json = await self.get_json(session, self.wiiubrew_api_url, {
+			"action": "query", "format": "json", "prop": "revisions", "rvprop": "ids", "titles": self.wiiubrew_page
+		})
+		for page in req_json["query"]["pages"].values():
+			revisions = page.get("revisions") or [{}]
+			return revisions[0].get("revid")
+		return None
+
+	async def get_wiiubrew_wikitext(self, session: aiohttp.ClientSession) -> str:
+		req_json = await self.get_json(session, self.wiiubrew_api_url, {
+			"action": "parse", "format": "json", "page": self.wiiubrew_page, "section": "5", "prop": "wikitext"
+		})
+		return req_json["parse"]["wikitext"]["*"]
+
+	@staticmethod
+	def parse_title_database(game_info: str) -> dict:
 		game_info = re.findall(r"\| ([0-9A-Fa-f]{8}-[0-9A-Fa-f]{8})\n\|(?: |)(.*?)(?: |)\n\|(?: |)(.*?)\n\|(?: |)(.*?)\n\|(?: |)(.*?)\n\|(?: |)(.*?)\n\|(?: |)(.*?)\n\|(?: |)(.*?)\n\|(?:-\n|)",
 								game_info)
 		game_info = [list(x) for x in game_info]
@@ -86,28 +151,34 @@ class Utility(commands.Cog):
 				"region": item[6],
 				"cdn_available": item[7]
 			}
-		game_info = temp
+		return temp
 
-		# see which game IDs the wiki actually has
-		wiki_game_ids = session.get("http://wiki.cemu.info/api.php?action=query&format=json&generator=allredirects&garlimit=5000")
-		validate_req(wiki_game_ids)
-		wiki_game_ids = get_all_results(wiki_game_ids, "garcontinue", wiki_game_ids.url)
-		temp = {}
-		for pageid in wiki_game_ids["query"]["pages"].keys():
-			temp[pageid] = wiki_game_ids["query"]["pages"][pageid]["title"]
-		wiki_game_ids = temp
-		wiki_game_ids = [x for x in wiki_game_ids.values() if re.findall(r"^[A-Za-z0-9]{4,6}$", x)]
-
-		for key in game_info.copy().keys():
-			game_info[key]["wiki_has_game_id_redirect"] = (game_info[key]["game_id"] in wiki_game_ids)
-
-		self.bot.title_ids = game_info
-		try:
-			f = open("misc/title_ids.json", "w", encoding="utf-8")
-		except FileNotFoundError:
-			f = open("misc/title_ids.json", "x+", encoding="utf-8")
-		json.dump(game_info, f, indent=4)
-		f.close()
+	async def get_wiki_game_ids(self, session: aiohttp.ClientSession) -> set:
+		"""The game IDs that the wiki has redirects for."""
+		# `&generator=allredirects` pages through the redirects in order of their targets, and
+		# `garfrom`/`garto` limit it to a range of targets, so each range can be paged through at the same time;
+		# every redirect has one target, so it's in one range (or two, if its target is a boundary)
+		bounds = [None, *self.redirect_range_bounds, None]
+		async def get_range(start: Optional[str], end: Optional[str]) -> dict:
+			params = {"action": "query", "format": "json", "generator": "allredirects", "garlimit": "5000"}
+			if start:
+				params["garfrom"] = start
+			if end:
+				params["garto"] = end
+			pages = {}
+			while True:
+				req_json = await self.get_json(session, self.wiki_api_url, params)
+				for pageid, page in req_json.get("query", {}).get("pages", {}).items():
+					pages[pageid] = page["title"]
+				# "continue" holds the argument that continues from where this page stopped (`garcontinue` here),
+				# along with anything else that the next request needs
+				if "continue" not in req_json:
+					return pages
+				params.update(req_json["continue"])
+		pages = {}
+		for result in await asyncio.gather(*(get_range(start, end) for start, end in zip(bounds, bounds[1:]))):
+			pages.update(result)
+		return {title for title in pages.values() if re.findall(r"^[A-Za-z0-9]{4,6}$", title)}
 
 async def setup(bot):
 	await bot.add_cog(Utility(bot))
\ No newline at end of file
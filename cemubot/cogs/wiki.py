@@ -0,0 +1,259 @@
+from .cache import LRUCache, atomic_write_json
+from .metrics import requests_hook
+import aiohttp
+import asyncio
+from discord.ext import commands, tasks
+import json
+import os
+import re
+import requests
+import time
+from typing import Optional
+
+
+class WikiPageCache:
+    """
+    Cache of Cemu wiki compatibility pages, keyed by title ID.
+    Pages are kept in an in-memory LRU and on disk, so they survive restarts
+    and are shared between parse worker processes. Once a page is older than
+    ttl seconds, it's revalidated with a conditional request (ETag/Last-Modified)
+    instead of being downloaded again.
+    """
+    def __init__(self, directory: str="misc/cache/wiki", ttl: float=6*60*60, max_size: int=256):
+        self.directory = directory
+        self.ttl = ttl
+        self.memory = LRUCache(max_size)
+        self.session = requests.Session()
+        self.session.hooks["response"].append(requests_hook)
+        # lookups that were answered without a request, and ones that needed one
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, title_id: str) -> str:
+        return os.path.join(self.directory, f"{title_id}.json")
+
+    def _load(self, title_id: str) -> Optional[dict]:
+        try:
+            with open(self._path(title_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, title_id: str, entry: dict) -> None:
+        self.memory.put(title_id, entry)
+        try:
+            atomic_write_json(self._path(title_id), entry)
+        except OSError:
+            # the memory tier still works without the disk tier
+            pass
+
+    def get(self, title_id: str, url: str) -> Optional[str]:
+        """Returns the HTML of the wiki page at url, or None if it couldn't be fetched."""
+        entry = self.memory.get(title_id)
+        if entry is None and (entry := self._load(title_id)) is not None:
+            self.memory.put(title_id, entry)
+        if entry is not None and entry["url"] != url:
+            # the title's page moved (e.g. it got a game ID redirect)
+            entry = None
+        if entry is not None and time.time() - entry["fetched"] < self.ttl:
+            self.hits += 1
+            return entry["html"]
+        self.misses += 1
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            req = self.session.get(url, headers=headers, timeout=10)
+        except requests.exceptions.RequestException:
+            # a stale page is better than no page
+            return entry["html"] if entry is not None else None
+        if req.status_code == 304 and entry is not None:
+            entry["fetched"] = time.time()
+            self._store(title_id, entry)
+            return entry["html"]
+        if req.status_code == 200:
+            self._store(title_id, {
+                "url": url,
+                "html": req.text,
+                "etag": req.headers.get("ETag"),
+                "last_modified": req.headers.get("Last-Modified"),
+                "fetched": time.time()
+            })
+            return req.text
+        return None
+
+
+class CompatIndex:
+    """
+    Compact compatibility index for the Cemu wiki, mapping title IDs to
+    {"rating": ..., "version": ..., "url": ...} for the latest test on the game's page.
+    Built in the background by the Wiki cog with batched MediaWiki API queries,
+    and stored on disk so that every process (including parse workers) can use it.
+    """
+    api_url = "http://wiki.cemu.info/api.php"
+    # the API accepts at most 50 titles per query
+    batch_size = 50
+    # the template that each row of a compatibility page's test results uses
+    testing_template = "testing/entry"
+
+    def __init__(self, path: str="misc/compat_index.json"):
+        self.path = path
+        self.entries = {}
+        self.mtime = None
+        self.reload_if_changed()
+
+    def reload_if_changed(self) -> None:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime == self.mtime:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+            self.mtime = mtime
+        except (OSError, ValueError):
+            pass
+
+    def get(self, title_id: str) -> Optional[dict]:
+        self.reload_if_changed()
+        return self.entries.get(title_id)
+
+    def update(self, entries: dict) -> None:
+        atomic_write_json(self.path, entries)
+        self.entries = entries
+        self.mtime = os.stat(self.path).st_mtime
+
+    @staticmethod
+    def page_title(title_info: dict) -> str:
+        """The wiki page title for an entry in title_ids.json; see ExtraParser.wiki_page_url."""
+        if title_info["wiki_has_game_id_redirect"]:
+            return title_info["game_id"]
+        title = re.sub(r"[^\x00-\x7f]", r"", title_info["game_title"])
+        return title.replace(" ", "_")
+
+    @staticmethod
+    def split_params(template: str) -> dict:
+        """Splits the parameters of a template, ignoring the |s inside of [[links]]."""
+        params = {}
+        depth = 0
+        current = ""
+        parts = []
+        for i, char in enumerate(template):
+            if template.startswith("[[", i):
+                depth += 1
+            elif template.startswith("]]", i) and depth:
+                depth -= 1
+            if char == "|" and not depth:
+                parts.append(current)
+                current = ""
+            else:
+                current += char
+        parts.append(current)
+        for part in parts[1:]:
+            key, sep, value = part.partition("=")
+            if sep:
+                params[key.strip().lower()] = value.strip()
+        return params
+
+    @classmethod
+    def parse_compat(cls, wikitext: str) -> Optional[dict]:
+        """Returns the rating and version of the last test on a page, or None if it has no tests."""
+        tests = re.findall(r"\{\{\s*" + re.escape(cls.testing_template) + r"(.*?)\}\}", wikitext, re.S|re.I)
+        if not tests:
+            return None
+        params = cls.split_params(tests[-1])
+        version = params.get("version", "")
+        # [[Release 1.26.2|1.26.2]] -> 1.26.2
+        link = re.match(r"\[\[(?:[^|\]]*\|)?([^\]]*)\]\]", version)
+        if link:
+            version = link.group(1)
+        return {
+            "rating": params.get("rating") or None,
+            "version": version or None
+        }
+
+    @classmethod
+    async def build(cls, session: aiohttp.ClientSession, title_ids: dict) -> dict:
+        """Builds a new index for every title in title_ids, using session for the API queries."""
+        pages = {}
+        for title_id, title_info in title_ids.items():
+            title = cls.page_title(title_info)
+            if title and "|" not in title:
+                pages.setdefault(title, []).append(title_id)
+        titles = list(pages)
+        entries = {}
+        for i in range(0, len(titles), cls.batch_size):
+            batch = titles[i:i+cls.batch_size]
+            params = {
+                "action": "query",
+                "format": "json",
+                "prop": "revisions",
+                "rvprop": "content",
+                "rvslots": "main",
+                "redirects": "1",
+                "titles": "|".join(batch)
+            }
+            async with session.get(cls.api_url, params=params) as res:
+                if res.status != 200:
+                    raise aiohttp.ClientResponseError(res.request_info, res.history, status=res.status)
+                query = (await res.json(content_type=None)).get("query", {})
+            # follow the API's title normalizations and redirects back to the titles we asked for
+            renames = {}
+            for item in query.get("normalized", []) + query.get("redirects", []):
+                renames[item["from"]] = item["to"]
+            contents = {}
+            for page in query.get("pages", {}).values():
+                if "missing" in page or not page.get("revisions"):
+                    continue
+                revision = page["revisions"][0]
+                contents[page["title"]] = revision.get("slots", {}).get("main", revision).get("*", "")
+            for title in batch:
+                final_title = title
+                seen = set()
+                while final_title in renames and final_title not in seen:
+                    seen.add(final_title)
+                    final_title = renames[final_title]
+                if final_title not in contents:
+                    continue
+                compat = cls.parse_compat(contents[final_title])
+                if compat is None:
+                    continue
+                compat["url"] = f"http://wiki.cemu.info/wiki/{title}"
+                for title_id in pages[title]:
+                    entries[title_id] = compat
+        return entries
+
+
+class Wiki(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if not self.update_compat_index.is_running():
+            self.update_compat_index.start()
+
+    def cog_unload(self):
+        self.update_compat_index.cancel()
+
+    @tasks.loop(hours=12.0)
+    async def update_compat_index(self):
+        try:
+            entries = await CompatIndex.build(self.bot.get_http_session(), self.bot.title_ids)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+            print("Failed to update the compatibility index! Error:")
+            print(str(err))
+            return
+        # an empty result means the wiki or its templates changed, so keep the old index
+        if entries:
+            self.bot.compat_index.update(entries)
+            self.bot.invalidate_parse_cache()
+
+
+async def setup(bot):
+    await bot.add_cog(Wiki(bot))
@@ -18,6 +18,16 @@ def configure():
     config["parsing_channel"] = {}
     config["parsing_channel"]["preferred"] = int(input("Preferred channel ID goes here (0 to parse in all channels): "))
     config["parsing_channel"]["alternates"] = list(map(int, input("Comma-separated list of IDs goes here (leave blank to skip): ").split(',')))
+    config["parse_executor"] = "thread"
+    config["parse_workers"] = 4
+    config["log_max_size"] = 16 * 1024 * 1024
+    config["wiki_cache_ttl"] = 6 * 60 * 60
+    config["parse_cache_size"] = 128
+    config["parse_queue_size"] = 50
+    config["parse_queue_per_user"] = 3
+    config["parse_timings"] = False
+    config["metrics_port"] = 0
+    config["gpu_database_max_age"] = 24 * 60 * 60
     config["compatibility_colors"] = {
         "perfect": 0x3380CC,
         "playable": 0x16A689,
@@ -0,0 +1,79 @@
+import json
+import os
+import random
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "cemubot"))
+
+from cogs.gpusearch import APIResult, GLVersion, GPUAPI, GPUDatabase, GPUInfoSearch, iter_opengl_rows, iter_vulkan_rows
+
+
+def opengl_database(*names: str) -> GPUDatabase:
+    return GPUDatabase({name: APIResult(GLVersion(4, 6), f"https://opengl.gpuinfo.org/displayreport.php?id={i}")
+                        for i, name in enumerate(names)})
+
+
+def offline_search(database: GPUDatabase) -> GPUInfoSearch:
+    search = GPUInfoSearch(init_cache=False, memo_path=None, snapshot_path=None, backfill=False)
+    search.database = database
+    return search
+
+
+def test_lookup_after_swap():
+    names = ("NVIDIA Tegra X1", "NVIDIA GeForce GTX 1060")
+    search = offline_search(opengl_database(*names))
+    before = search.search("NVIDIA Tegra X1 (nvgpu)/PCIe/SSE2", GPUAPI.OpenGL).opengl
+    assert before is not None
+    search.swap_database(opengl_database(*names))
+    after = search.search("NVIDIA Tegra X1 (nvgpu)/PCIe/SSE2", GPUAPI.OpenGL).opengl
+    assert after is not None and after.url == before.url
+
+
+def test_spellings_in_different_partitions():
+    search = offline_search(opengl_database("NVIDIA Tegra X1", "Tegra X1 Emulated"))
+    # without its vendor, "Tegra X1" is searched for in a different partition than "NVIDIA Tegra X1"
+    with_vendor = search.search("NVIDIA Tegra X1/PCIe/SSE2", GPUAPI.OpenGL).opengl
+    without_vendor = search.search("Tegra X1/PCIe/SSE2", GPUAPI.OpenGL).opengl
+    assert with_vendor is not None and with_vendor.url.endswith("id=0")
+    assert without_vendor is not None and without_vendor.url.endswith("id=1")
+
+
+def random_chunks(rng: random.Random, text: str) -> list:
+    """Splits text at random places, sometimes into single characters."""
+    cuts = sorted(rng.sample(range(1, len(text)), min(len(text) - 1, rng.choice((1, 5, 50, len(text))))))
+    return [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+
+
+def opengl_page(rng: random.Random) -> str:
+    rows = ["<tr><th>Device</th><th>Version</th></tr>"]
+    for i in range(40):
+        rows.append(f"<tr>\n<td class='firstrow'><a href='displayreport.php?id={rng.randint(1, 99999)}'>"
+                    f"GPU {i} <b>{rng.choice(['', 'Laptop', '(TM)'])}</b></a></td>\n"
+                    f"<td class='unsupported'>-</td><td class='valuezeroleftblack'>4.{rng.randint(0, 6)}</td></tr>")
+    return f"<html><body><table>{''.join(rows)}</table></body></html>"
+
+
+def vulkan_body(rng: random.Random) -> str:
+    data = [{"device": f"<a href=\"listreports.php?devicename=GPU%20{i}\">GPU {i} \\ \"{rng.random()}\"</a>",
+             "api": f"1.{rng.randint(0, 3)}.{rng.randint(0, 300)}", "reports": [i, {"a": "]"}]}
+            for i in range(40)]
+    return json.dumps({"draw": 1, "recordsTotal": len(data), "data": data}, indent=rng.choice((None, 1)))
+
+
+def test_opengl_rows_across_chunks():
+    rng = random.Random(18)
+    row = re.compile(r"<tr>.*?<td class='firstrow'><a href='(displayreport\.php\?id=.+?)'>(.+?)</a></td>.*?"
+                     r"<td class='valuezeroleftblack'>(.+?)</td>.*?</tr>", re.S)
+    for _ in range(200):
+        page = opengl_page(rng)
+        assert list(iter_opengl_rows(random_chunks(rng, page))) == row.findall(page)
+
+
+def test_vulkan_rows_across_chunks():
+    rng = random.Random(18)
+    link = re.compile(r"<a href=\"(listreports\.php\?devicename=.*?)\">(.*?)</a>")
+    for _ in range(200):
+        body = vulkan_body(rng)
+        expected = [link.search(device["device"]).groups() + (device["api"],) for device in json.loads(body)["data"]]
+        assert list(iter_vulkan_rows(random_chunks(rng, body))) == expected
@@ -0,0 +1,57 @@
+import os
+import random
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "cemubot"))
+
+from cogs.parser import LogPatternSet
+
+# literals with shared prefixes of 8 characters or more, which LogPatternSet searches for together
+literals = [
+    "Mods/FPS++", "Mods/FPS++/", "Mods/FPS", "Mods/Static FPS", "graphicPacks/BreathOfTheWild",
+    "graphicPacks/BreathOfTheWild_Mods", "graphicPacks/Bre", "Vulkan", "Vulkan API", "abc",
+]
+regexes = [
+    # lookbehinds, which can look at the text before where the alternation is searched again from
+    r"(?<!CPU[0-9] )CPU: (.*?) *$", r"(?<=Mods/)FPS", r"(?<![a-z])abc",
+    # ^ and $, which match at every line with re.M
+    r"^Vulkan", r"FPS\+\+$", r"^$", r"^abc$", r"(?:^|/)Static",
+    # backreferences and named groups, which can't be combined
+    r"(a)b\1", r"(?P<x>[ab])c(?P=x)", r"(?P<name>Vulkan)",
+    # alternatives that match at the same place as each other
+    r"Mods", r"Mods/F", r"Mods/FPS\+\+", r"[A-Z]\w+", r"\d+", r"a|b", r"Vulkan API|Vulkan",
+    r"(?i)vulkan", r"x*", r"CPU[0-9] CPU: ", r"\n\n",
+]
+fragments = [
+    "CPU: ", "CPU0 CPU: ", "Mods/", "FPS++", "/", "Static FPS", "graphicPacks/", "BreathOfTheWild", "_Mods",
+    "Vulkan", " API", "abc", "aba", "bcb", "aca", "12", "\n", "\n", " ", "x",
+]
+
+
+def direct(keys, log):
+    return {(kind, value) for kind, value in keys
+            if (value in log if kind == "literal" else re.search(value, log, re.M))}
+
+
+def test_scan_matches_direct_checks():
+    rng = random.Random(25)
+    keys = [("literal", literal) for literal in literals] + [("regex", regex) for regex in regexes]
+    for _ in range(2000):
+        subset = rng.sample(keys, rng.randint(1, len(keys)))
+        log = "".join(rng.choice(fragments) for _ in range(rng.randint(0, 40)))
+        assert LogPatternSet(subset).scan(log) == direct(subset, log), (subset, log)
+
+
+def test_literals_with_shared_prefix():
+    patterns = LogPatternSet([("literal", literal) for literal in literals])
+    # "Mods/FPS", "Mods/FPS++" and "Mods/FPS++/" share the "Mods/FPS" prefix
+    assert any(prefix == "Mods/FPS" and len(group) == 3 for prefix, group in patterns.literal_groups)
+    log = "x/Mods/FPS\ny/Mods/FPS++/z\n"
+    assert patterns.scan(log) == {("literal", "Mods/FPS"), ("literal", "Mods/FPS++"), ("literal", "Mods/FPS++/")}
+
+
+def test_uncombinable_regexes_are_searched_separately():
+    patterns = LogPatternSet([("regex", r"(a)b\1"), ("regex", r"(?P<x>a)"), ("regex", r"(?i)A"), ("regex", r"b")])
+    assert patterns.combined == [r"b"]
+    assert patterns.scan("aba") == {("regex", r"(a)b\1"), ("regex", r"(?P<x>a)"), ("regex", r"(?i)A"), ("regex", r"b")}